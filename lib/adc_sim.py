@@ -3,40 +3,77 @@
 
 from i2c_sim import I2C
 
+# Optional stand-in for the hardware: a callable taking a channel number (0-7) and returning the reading. The track
+# simulator (track_sim.Simulator.attach) sets this so that grayscale readings come from a virtual track.
+source = None
+
 class ADC(I2C):
     ADDR=0x14                   # 扩展板的地址为0x14
+    # Set to True on MCU firmware that answers a register read with the 2-byte sample, so that each channel is read in
+    # one combined write/read transaction instead of a word write followed by two single-byte reads.
+    BLOCK_READ = False
 
     def __init__(self, chn):    # 参数，通道数，树莓派扩展板上有8个adc通道分别为"A0, A1, A2, A3, A4, A5, A6, A7"
         super().__init__()
-        if isinstance(chn, str):
-            if chn.startswith("A"):     # 判断穿境来的参数是否为A开头，如果是，取A后面的数字出来
-                chn = int(chn[1:])
-            else:
-                raise ValueError("ADC channel should be between [A0, A7], not {0}".format(chn))
-        if chn < 0 or chn > 7:          # 判断取出来的数字是否在0~7的范围内
-            self._error('Incorrect channel range')
-        chn = 7 - chn
-        self.chn = chn | 0x10           # 给从机地址
+        self.ADDR = self.probe_board_address(self.ADDR)  # Same board, so the same address as the PWM channels.
+        self.chn = self._channel_cmd(chn)  # 给从机地址
         self.reg = 0x40 + self.chn
         # self.bus = smbus.SMBus(1)
         
     def read(self):                     # adc通道读取数---写一次数据，读取两次数据 （读取的数据范围是0~4095）
+        if source is not None:
+            return source(7 - (self.chn & 0x0f))
         # self._debug("Write 0x%02X to 0x%02X"%(self.chn, self.ADDR))
         # self.bus.write_byte(self.ADDR, self.chn)      # 写入数据
-        self.send([self.chn, 0, 0], self.ADDR)
+        # Hold the bus for the whole exchange, so another thread cannot slip a transaction in between.
+        with self._lock:
+            self.send([self.chn, 0, 0], self.ADDR)
 
-        # self._debug("Read from 0x%02X"%(self.ADDR))
-        # value_h = self.bus.read_byte(self.ADDR)
-        value_h = self.recv(1, self.ADDR)[0]            # 读取数据
+            # self._debug("Read from 0x%02X"%(self.ADDR))
+            # value_h = self.bus.read_byte(self.ADDR)
+            value_h = self.recv(1, self.ADDR)[0]            # 读取数据
 
-        # self._debug("Read from 0x%02X"%(self.ADDR))
-        # value_l = self.bus.read_byte(self.ADDR)
-        value_l = self.recv(1, self.ADDR)[0]            # 读取数据（读两次）
+            # self._debug("Read from 0x%02X"%(self.ADDR))
+            # value_l = self.bus.read_byte(self.ADDR)
+            value_l = self.recv(1, self.ADDR)[0]            # 读取数据（读两次）
 
         value = (value_h << 8) + value_l
         # self._debug("Read value: %s"%value)
         return value
 
+    def _channel_cmd(self, chn):
+        """Convert a channel name ("A0") or number to the command byte the MCU expects."""
+        if isinstance(chn, str):
+            if chn.startswith("A"):     # 判断穿境来的参数是否为A开头，如果是，取A后面的数字出来
+                chn = int(chn[1:])
+            else:
+                raise ValueError("ADC channel should be between [A0, A7], not {0}".format(chn))
+        if chn < 0 or chn > 7:          # 判断取出来的数字是否在0~7的范围内
+            self._error('Incorrect channel range')
+        return (7 - chn) | 0x10
+
+    def read_many(self, chns):
+        """Read several channels back to back, e.g. read_many(["A0", "A1", "A2"]), and return the values as a list.
+
+        Goes straight to the SMBus calls on this one handle, skipping the argument parsing and buffer allocation that
+        send()/recv() do per call. With BLOCK_READ each channel costs a single bus transaction."""
+        cmds = [self._channel_cmd(chn) for chn in chns]
+        if source is not None:
+            return [source(7 - (cmd & 0x0f)) for cmd in cmds]
+        values = []
+        if self.BLOCK_READ:
+            for cmd in cmds:
+                value_h, value_l = self._i2c_read_i2c_block_data(self.ADDR, cmd, 2)
+                values.append((value_h << 8) + value_l)
+        else:
+            for cmd in cmds:
+                with self._lock:  # Each channel's write and two reads must not interleave with other threads.
+                    self._i2c_write_word_data(self.ADDR, cmd, 0)    # Same bytes as send([cmd, 0, 0])
+                    value_h = self._i2c_read_byte(self.ADDR)
+                    value_l = self._i2c_read_byte(self.ADDR)
+                values.append((value_h << 8) + value_l)
+        return values
+
     def read_voltage(self):                             # 将读取的数据转化为电压值（0~3.3V）
         return self.read*3.3/4095
         
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Injectable clock used for all timing in rossros, the busses, the controller and the sensors.
+
+Code calls clock.time(), clock.sleep(), ... instead of the time module. By default these go to RealClock, which is
+just the time module. Installing a SimClock with set_clock() makes the same code run in virtual time: sleeping threads
+are woken one at a time in order of their wake-up times, and time jumps straight to the next wake-up as soon as every
+registered thread is asleep. Runs are as fast as the code allows and repeatable, e.g. a ten minute drive in seconds."""
+
+import heapq
+import threading
+import time as _time
+
+
+class RealClock(object):
+    """Wall clock time. Registration is not needed and does nothing."""
+    virtual = False
+
+    def time(self):
+        return _time.time()
+
+    def monotonic(self):
+        return _time.monotonic()
+
+    def perf_counter(self):
+        return _time.perf_counter()
+
+    def sleep(self, seconds):
+        _time.sleep(max(seconds, 0))
+
+    def wait_for(self, predicate, timeout=None, condition=None):
+        """Wait until predicate() is true or timeout seconds pass, woken early by notifications on condition."""
+        if condition is None:
+            condition = threading.Condition()
+        with condition:
+            return condition.wait_for(predicate, timeout)
+
+    def register(self, count=1):
+        pass
+
+    def unregister(self):
+        pass
+
+    def start(self, rank):
+        pass
+
+
+class SimClock(object):
+    """Virtual time shared by a set of threads, run one at a time.
+
+    Every thread that sleeps on the clock must be registered first (register(n) from the thread that starts them,
+    unregister() from each one as it finishes), so the clock knows when all of them are asleep. It then wakes only the
+    sleeper with the earliest wake-up time, moving time forward to it, and waits for that thread to sleep again. Ties
+    go to the lower rank (see start()), then to whoever went to sleep first, so a run always interleaves the threads the
+    same way as long as they only block on the clock. A registered thread that blocks on anything else stops time.
+    With nothing registered, sleep() simply advances time, which suits single-threaded use. sleep(0) and polling loops
+    advance time by `resolution` so that they still make progress."""
+    virtual = True
+
+    def __init__(self, start=0.0, resolution=1e-4):
+        self._now = start
+        self.resolution = resolution
+        self._participants = 0
+        self._sleepers = []  # Heap of (wake-up time, rank, order) of the threads sleeping right now.
+        self._order = 0
+        self._turn = None  # Heap entry of the thread that was woken last.
+        self._cv = threading.Condition()
+        self._local = threading.local()
+
+    def time(self):
+        return self._now
+
+    monotonic = time
+    perf_counter = time
+
+    def register(self, count=1):
+        with self._cv:
+            self._participants += count
+
+    def unregister(self):
+        with self._cv:
+            self._participants -= 1
+            self._advance_if_idle()
+
+    def _advance_if_idle(self):
+        # Called with the lock held. Hand the turn to the next sleeper once every participant is asleep.
+        if self._sleepers and len(self._sleepers) >= max(self._participants, 1):
+            self._turn = heapq.heappop(self._sleepers)
+            self._now = max(self._now, self._turn[0])
+            self._cv.notify_all()
+
+    def _sleep_until(self, wake):
+        with self._cv:
+            self._order += 1
+            entry = (wake, getattr(self._local, 'rank', 0), self._order)
+            heapq.heappush(self._sleepers, entry)
+            self._advance_if_idle()
+            while self._turn is not entry:
+                self._cv.wait()
+
+    def start(self, rank):
+        """Called by a registered thread before it does anything else: give it a rank for breaking ties, and wait
+        for its turn, so that the threads also take their first steps in a fixed order."""
+        self._local.rank = rank
+        self._sleep_until(self._now)
+
+    def sleep(self, seconds):
+        self._sleep_until(self._now + max(seconds, self.resolution))
+
+    def wait_for(self, predicate, timeout=None, condition=None):
+        """Poll predicate() every `resolution` of virtual time until it is true or timeout seconds pass."""
+        deadline = None if timeout is None else self._now + timeout
+        while not predicate():
+            if deadline is not None and self._now >= deadline:
+                return False
+            self.sleep(self.resolution if deadline is None else min(self.resolution, deadline - self._now))
+        return True
+
+
+_clock = RealClock()
+
+def get_clock():
+    return _clock
+
+def set_clock(new_clock):
+    """Install the clock used from now on and return the previous one."""
+    global _clock
+    previous = _clock
+    _clock = new_clock
+    return previous
+
+def is_virtual():
+    return _clock.virtual
+
+def time():
+    return _clock.time()
+
+def monotonic():
+    return _clock.monotonic()
+
+def perf_counter():
+    return _clock.perf_counter()
+
+def sleep(seconds):
+    _clock.sleep(seconds)
+
+def wait_for(predicate, timeout=None, condition=None):
+    return _clock.wait_for(predicate, timeout, condition)
+
+def register(count=1):
+    _clock.register(count)
+
+def unregister():
+    _clock.unregister()
+
+def start(rank):
+    _clock.start(rank)
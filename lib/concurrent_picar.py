@@ -5,14 +5,14 @@
 
 from readerwriterlock import rwlock
 import bus
-import concurrent.futures
+import rossros as rr
 import picarx_improved
-import time
+import clock
 import numpy as np
 import atexit
 import line_following_controller as control
 import line_following_interpreter as interp
-from ultrasonic import Ultrasonic
+import ultrasonic
 import grayscale_module
 import picarx_improved
 from utils import reset_mcu
@@ -23,27 +23,34 @@ logging.getLogger().setLevel(logging.DEBUG)
 
 
 
-def concurrent_sense(sensor,sensor_bus,sensor_delay):
-    while True:
+def concurrent_sense(sensor,sensor_bus,sensor_delay,term_bus):
+    while not term_bus.read():
         raw_data = sensor.get_grayscale_data()
         logging.info(f"sensor_data: {raw_data}")
         sensor_bus.write(raw_data)
-        time.sleep(sensor_delay)
+        clock.sleep(sensor_delay)
 
-def concurrent_interp(interpreter,sensor_bus,interp_bus,interp_delay):
-    while True:
-        sensor_data = sensor_bus.read()
-        direction = interpreter.get_direction(sensor_data)
-        interp_bus.write(direction)
-        time.sleep(interp_delay)
+def concurrent_interp(interpreter,sensor_bus,interp_bus,interp_delay,term_bus):
+    last_seq = -1
+    while not term_bus.read():
+        # Only interpret when the sensor has published a new reading.
+        sensor_data, seq, _ = sensor_bus.read_stamped()
+        if seq != last_seq:
+            direction = interpreter.get_direction(sensor_data)
+            interp_bus.write(direction)
+            last_seq = seq
+        # Wake up as soon as the sensor publishes, or after interp_delay at the latest.
+        sensor_bus.wait_for_change(last_seq, interp_delay)
 
-def concurrent_control(controller,sonar,interp_bus,control_delay):
-    while True:
+def concurrent_control(controller,sonar,interp_bus,control_delay,term_bus):
+    while not term_bus.read():
         logging.info("Control Heartbeat")
+        # The sonar pings in the background, so this only reads its filtered distance.
         obstacle = sonar.obstacle()
-        direction = interp_bus.read()
+        direction, seq, _ = interp_bus.read_stamped()
         controller.follow_line_with_ultrasonic(direction,obstacle)
-        time.sleep(control_delay)
+        # Act on a new direction as soon as it is published, but still poll the sonar every control_delay.
+        interp_bus.wait_for_change(seq, control_delay)
 
 def init_busses(sensor_bus,interp_bus,sensor,interpreter):
     """Put valid valid values on the busses before entering operation."""
@@ -52,34 +59,34 @@ def init_busses(sensor_bus,interp_bus,sensor,interpreter):
     direction = interpreter.get_direction(sensor_data)
     interp_bus.write(direction)
 
-def cleanup(executor,car):
-    executor.shutdown()
-    time.sleep(0.5)
+def stop_all(term_bus,car):
+    """Stop the motors first, then signal every loop to exit."""
     car.stop()
+    term_bus.write(True)
 
 def main():
     logging.getLogger().setLevel(logging.DEBUG)
     interpreter = interp.Interpreter(proportional_gain=3,derivative_gain=0,line_polarity='darker')
     sensor = grayscale_module.Grayscale_Module(950) #950
     car = picarx_improved.Picarx()
-    sonar = Ultrasonic()
+    sonar = ultrasonic.get_sensor()
+    sonar.start_ranging()
     controller = control.Controller(car,pwm_percent = 30)
     controller.fill_buffer(interpreter, sensor)
-    sensor_bus = bus.Bus()
-    interp_bus = bus.Bus()
+    sensor_bus = bus.SeqBus()
+    interp_bus = bus.SeqBus()
     # Put valid valid values on the busses before entering operation.
     init_busses(sensor_bus,interp_bus,sensor,interpreter)
 
-    # We can use a with statement to ensure threads are cleaned up promptly
-    with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-        atexit.register(cleanup,executor, car)
-        # Start each process, which will run forever...
-        thread1 = executor.submit(concurrent_sense,sensor,sensor_bus,0.01)
-        thread2 = executor.submit(concurrent_interp,interpreter,sensor_bus,interp_bus,0.01)
-        thread3 = executor.submit(concurrent_control,controller,sonar,interp_bus,0.01)
-    thread1.result()
-    thread2.result()
-    thread3.result()
+    term_bus = bus.SeqBus(False)
+    atexit.register(stop_all, term_bus, car)
+
+    # Run each loop in its own thread. If any of them raises, the car is stopped and the others are told to exit
+    # straight away, instead of leaving the motors running until every thread has finished.
+    rr.superviseThreads([lambda: concurrent_sense(sensor,sensor_bus,0.01,term_bus),
+                         lambda: concurrent_interp(interpreter,sensor_bus,interp_bus,0.01,term_bus),
+                         lambda: concurrent_control(controller,sonar,interp_bus,0.01,term_bus)],
+                        lambda: stop_all(term_bus, car))
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,166 @@
+"""Contains a shared-memory bus for passing camera frames between threads and processes without copying them."""
+
+import time
+import clock
+import numpy as np
+from multiprocessing import shared_memory
+from bus import BusInterface
+
+
+class FrameBus(BusInterface):
+    """Bus for fixed-size numpy frames (e.g. 480x640x3 BGR images) backed by multiprocessing.shared_memory.
+
+    The bus holds a small pool of preallocated buffers (three by default, i.e. triple buffering). The producer fills the
+    next free buffer in place and publishes it; readers get a read-only view of the latest buffer together with its
+    generation number, so nothing is pickled or copied on the way. A view stays intact until the writer comes back
+    around to its buffer, n_buffers - 1 publishes later; use intact(generation) to check, or read_copy() to keep a
+    frame for longer. Only one writer may use a FrameBus at a time.
+
+    Pickling a FrameBus (e.g. handing it to a spawned process) reattaches to the same shared memory by name. Listeners
+    are only notified of publishes from their own process."""
+
+    # This bus already lives in shared memory, so rossros.runConcurrently(backend="process") leaves it in place.
+    process_shared = True
+
+    def __init__(self, shape=(480, 640, 3), dtype=np.uint8, n_buffers=3, name="Unnamed Frame Bus", _shm_name=None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.n_buffers = n_buffers
+        self.name = name
+        self.listeners = []
+
+        # Layout: [generation, latest index, generation of each buffer] as int64, a timestamp per buffer, the buffers.
+        self._header_size = (2 + n_buffers) * 8
+        self._stamps_size = n_buffers * 8
+        self._frame_size = int(np.prod(self.shape)) * self.dtype.itemsize
+        size = self._header_size + self._stamps_size + n_buffers * self._frame_size
+        self._owner = _shm_name is None
+        if self._owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=_shm_name)
+
+        self._header = np.ndarray((2 + n_buffers,), dtype=np.int64, buffer=self.shm.buf)
+        self._stamps = np.ndarray((n_buffers,), dtype=np.float64, buffer=self.shm.buf, offset=self._header_size)
+        self._frames = np.ndarray((n_buffers,) + self.shape, dtype=self.dtype, buffer=self.shm.buf,
+                                  offset=self._header_size + self._stamps_size)
+        if self._owner:
+            self._header[:] = 0
+            self._stamps[:] = clock.time()
+            self._frames[:] = 0
+
+    def __getstate__(self):
+        return {"shape": self.shape, "dtype": self.dtype.str, "n_buffers": self.n_buffers, "name": self.name,
+                "_shm_name": self.shm.name}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @property
+    def generation(self):
+        """Generation number of the latest frame. 0 means nothing has been published yet."""
+        return int(self._header[0])
+
+    @property
+    def seq(self):
+        return self.generation
+
+    @property
+    def timestamp(self):
+        """clock.time() at which the latest frame was published."""
+        return float(self._stamps[self._header[1]])
+
+    @property
+    def message(self):
+        return self.read()
+
+    def next_buffer(self):
+        """Writable view of the buffer that the next publish() will expose. Fill it in place, then call publish()."""
+        index = (int(self._header[1]) + 1) % self.n_buffers
+        self._header[2 + index] = -1  # Mark as being written, so readers still holding it see it is no longer intact.
+        return self._frames[index]
+
+    def publish(self):
+        """Expose the buffer returned by next_buffer() as the latest frame."""
+        index = (int(self._header[1]) + 1) % self.n_buffers
+        generation = int(self._header[0]) + 1
+        self._header[2 + index] = generation
+        self._stamps[index] = clock.time()
+        self._header[1] = index
+        self._header[0] = generation
+        for condition in self.listeners:
+            with condition:
+                condition.notify_all()
+        return generation
+
+    def write(self,frame):
+        """Copy frame into the next buffer and publish it."""
+        np.copyto(self.next_buffer(), frame)
+        return self.publish()
+
+    def read_latest(self):
+        """Return (read-only view of the latest frame, its generation) without copying."""
+        index = int(self._header[1])
+        generation = int(self._header[2 + index])
+        view = self._frames[index]
+        view.flags.writeable = False
+        return view, generation
+
+    def read(self):
+        return self.read_latest()[0]
+
+    def read_copy(self):
+        """Return a private copy of the latest frame and its generation."""
+        view, generation = self.read_latest()
+        return view.copy(), generation
+
+    def intact(self,generation):
+        """True if the frame with this generation has not been overwritten since it was read. Always False for a
+        buffer that was being written when it was read (-1) and for the blank frame before the first publish (0)."""
+        return generation > 0 and generation in self._header[2:]
+
+    def changed_since(self,generation):
+        return self.generation > generation
+
+    def close(self):
+        """Detach from the shared memory, and free it if this instance created it."""
+        self._header = self._stamps = self._frames = None
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
+
+
+def benchmark(iterations=200):
+    """Compare the time to hand off a 640x480 BGR frame through a FrameBus and through a Manager list (as Vilib does)."""
+    from multiprocessing import Manager
+    frame = np.random.randint(0, 255, (480, 640, 3), dtype=np.uint8)
+
+    frame_bus = FrameBus(frame.shape)
+    t_start = time.perf_counter()
+    for i in range(iterations):
+        buffer = frame_bus.next_buffer()
+        buffer[0, 0, 0] = i  # Stand-in for a camera filling the buffer in place.
+        frame_bus.publish()
+        view, generation = frame_bus.read_latest()
+    frame_bus_time = (time.perf_counter() - t_start) / iterations
+    frame_bus.close()
+
+    manager = Manager()
+    img_array = manager.list(range(2))
+    t_start = time.perf_counter()
+    for i in range(iterations):
+        img_array[0] = frame
+        img = img_array[0]
+    manager_time = (time.perf_counter() - t_start) / iterations
+    manager.shutdown()
+
+    print("FrameBus handoff:     {:10.1f} us".format(frame_bus_time * 1e6))
+    print("Manager list handoff: {:10.1f} us".format(manager_time * 1e6))
+    return frame_bus_time, manager_time
+
+
+def main():
+    benchmark()
+
+if __name__ == '__main__':
+    main()
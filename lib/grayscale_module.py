@@ -1,7 +1,15 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from adc import ADC
+import threading
+import clock
+import numpy as np
+import platform
+if platform.node() == 'raspberrypi' or platform.node() == 'cecilia':  # Import real classes on the picar.
+    from adc import ADC
+else:  # Not being run on the raspberry pi. Import simulation classes.
+    from adc_sim import ADC
+from ring_bus import RingBus
 import line_following_interpreter
 from utils import reset_mcu
 reset_mcu()
@@ -15,7 +23,13 @@ class Grayscale_Module(object):
         self.chn_0 = ADC("A0")
         self.chn_1 = ADC("A1")
         self.chn_2 = ADC("A2")
+        self.channels = ["A0", "A1", "A2"]
         self.ref = ref
+        # Streaming mode state, see start_streaming.
+        self.samples = None
+        self.streaming = False
+        self.sampler = None
+        self.overruns = 0
 
     def get_line_status(self,fl_list):
 
@@ -32,15 +46,78 @@ class Grayscale_Module(object):
             return 'left'
 
     def get_grayscale_data(self):
-        adc_value_list = []
-        adc_value_list.append(self.chn_0.read())
-        adc_value_list.append(self.chn_1.read())
-        adc_value_list.append(self.chn_2.read())
-        return adc_value_list
+        # All three channels in one batched read on a single I2C handle.
+        return self.chn_0.read_many(self.channels)
 
     def __call__(self):
         return self.get_grayscale_data()
 
+    def start_streaming(self, rate=200, size=1024):
+        """Start a background thread that samples the three channels `rate` times a second into a ring buffer of the
+        last `size` rows of (timestamp, a0, a1, a2). Consumers then read from memory with latest(), mean() or by
+        iterating, instead of waiting on the I2C bus."""
+        if self.streaming:
+            return
+        self.samples = RingBus(size, shape=(4,), name="Grayscale Samples")
+        self.streaming = True
+        clock.register()  # So the sampler takes part in virtual time under a clock.SimClock.
+        self.sampler = threading.Thread(target=self._sample, args=(1 / rate,), name="Grayscale sampler", daemon=True)
+        self.sampler.start()
+
+    def stop_streaming(self):
+        self.streaming = False
+        if self.sampler is not None:
+            self.sampler.join()
+            self.sampler = None
+
+    def _sample(self, period):
+        """Sampler loop. Runs on absolute deadlines so the sample rate does not drift with the I2C read time."""
+        try:
+            next_deadline = clock.monotonic()
+            row = np.empty(4)
+            while self.streaming:
+                row[0] = clock.time()
+                row[1:] = self.get_grayscale_data()
+                self.samples.write(row)
+                next_deadline += period
+                delay = next_deadline - clock.monotonic()
+                if delay > 0:
+                    clock.sleep(delay)
+                else:
+                    self.overruns += 1
+                    next_deadline = clock.monotonic()
+        finally:
+            clock.unregister()
+
+    def _streamed_samples(self):
+        if self.samples is None:
+            raise RuntimeError("Grayscale_Module: call start_streaming() before reading streamed samples")
+        return self.samples
+
+    def latest(self):
+        """Most recent (timestamp, a0, a1, a2) row, or None if no sample has been taken yet."""
+        return self._streamed_samples().latest()
+
+    def mean(self, window=10):
+        """Average (a0, a1, a2) over the last `window` samples."""
+        return self._streamed_samples().window(window)[:, 1:].mean(axis=0)
+
+    def __iter__(self):
+        """Yield every new (timestamp, a0, a1, a2) row, as a copy, until streaming stops. Rows older than the ring
+        buffer are skipped if the consumer falls more than `size` samples behind."""
+        samples = self._streamed_samples()
+        new_sample = threading.Condition()
+        samples.subscribe(new_sample)
+        try:
+            seq = samples.seq
+            while self.streaming:
+                clock.wait_for(lambda: samples.seq > seq or not self.streaming, 1, new_sample)
+                rows, seq = samples.read_since(seq)
+                for row in rows.copy():
+                    yield row
+        finally:
+            samples.unsubscribe(new_sample)
+
 def main():
     import time
     interp = line_following_interpreter.Interpreter()
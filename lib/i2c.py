@@ -2,41 +2,124 @@
 # -*- coding: utf-8 -*-
 
 # from .basic import _Basic_class
+import os
+import threading
+import multiprocessing
 from smbus import SMBus
 
+class BusLock(object):
+    """Reentrant lock for one bus, shared with forked processes. A process that is killed while holding it never
+    releases it, so reset() swaps in a new lock; threads waiting on the old one move over to it."""
+
+    def __init__(self):
+        self._lock = multiprocessing.get_context("fork").RLock()
+        self._held = threading.local()  # Per thread, the locks acquired and not yet released.
+
+    def __enter__(self):
+        lock = self._lock
+        while not lock.acquire(timeout=0.1):
+            lock = self._lock
+        self._held.__dict__.setdefault("locks", []).append(lock)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._held.locks.pop().release()
+
+    def reset(self):
+        self._lock = multiprocessing.get_context("fork").RLock()
+
+
+# One SMBus handle per bus number for the whole process, plus a lock per bus that serializes transactions on it, so
+# that users of the bus cannot interleave multi-step exchanges such as an ADC read. The lock is a BusLock rather than a
+# threading lock, so it also holds across the processes that rossros.runConcurrently(backend="process") forks: they all
+# inherit the same semaphore, and rossros calls reset_locks() if it has to kill one of them. Each forked process
+# reopens its handles (see _reopen_smbus), since the I2C slave address is set per open file and would otherwise be
+# shared.
+_smbus_pool = {}
+_smbus_locks = {}
+_pool_lock = threading.Lock()
+
+def get_smbus(bus):
+    """Return the process-wide (SMBus handle, lock) for bus number `bus`, opening the handle on first use."""
+    with _pool_lock:
+        if bus not in _smbus_pool:
+            _smbus_pool[bus] = SMBus(bus)
+            _smbus_locks[bus] = BusLock()
+        return _smbus_pool[bus], _smbus_locks[bus]
+
+def reset_locks():
+    """Replace every bus lock, after a process sharing them was killed, perhaps in the middle of a transaction."""
+    with _pool_lock:
+        for lock in _smbus_locks.values():
+            lock.reset()
+
+def _reopen_smbus():
+    # Runs in every forked child. The handles are reopened in place, so I2C objects created before the fork keep
+    # working; the locks are deliberately kept.
+    for bus, handle in _smbus_pool.items():
+        handle.close()
+        handle.open(bus)
+
+os.register_at_fork(after_in_child=_reopen_smbus)
+
+
 class I2C(object):
     MASTER = 0
     SLAVE  = 1
     RETRY = 5
 
+    # Address of the robot HAT's MCU, found once per process by probe_board_address.
+    _board_address = None
+    _probe_lock = threading.Lock()
+
     def __init__(self, *args, **kargs):     # *args表示位置参数（形式参数），可无，； **kargs表示默认值参数，可无。
         super().__init__()
         self._bus = 1
-        self._smbus = SMBus(self._bus)
+        self._smbus, self._lock = get_smbus(self._bus)
 
     def _i2c_write_byte(self, addr, data):   # i2C 写系列函数
         # self._debug("_i2c_write_byte: [0x{:02X}] [0x{:02X}]".format(addr, data))
-        return self._smbus.write_byte(addr, data)
+        with self._lock:
+            return self._smbus.write_byte(addr, data)
     
     def _i2c_write_byte_data(self, addr, reg, data):
         # self._debug("_i2c_write_byte_data: [0x{:02X}] [0x{:02X}] [0x{:02X}]".format(addr, reg, data))
-        return self._smbus.write_byte_data(addr, reg, data)
+        with self._lock:
+            return self._smbus.write_byte_data(addr, reg, data)
     
     def _i2c_write_word_data(self, addr, reg, data):
         # self._debug("_i2c_write_word_data: [0x{:02X}] [0x{:02X}] [0x{:04X}]".format(addr, reg, data))
-        return self._smbus.write_word_data(addr, reg, data)
+        with self._lock:
+            return self._smbus.write_word_data(addr, reg, data)
     
     def _i2c_write_i2c_block_data(self, addr, reg, data):
         # self._debug("_i2c_write_i2c_block_data: [0x{:02X}] [0x{:02X}] {}".format(addr, reg, data))
-        return self._smbus.write_i2c_block_data(addr, reg, data)
+        with self._lock:
+            return self._smbus.write_i2c_block_data(addr, reg, data)
     
     def _i2c_read_byte(self, addr):   # i2C 读系列函数
         # self._debug("_i2c_read_byte: [0x{:02X}]".format(addr))
-        return self._smbus.read_byte(addr)
+        with self._lock:
+            return self._smbus.read_byte(addr)
 
     def _i2c_read_i2c_block_data(self, addr, reg, num):
         # self._debug("_i2c_read_i2c_block_data: [0x{:02X}] [0x{:02X}] [{}]".format(addr, reg, num))
-        return self._smbus.read_i2c_block_data(addr, reg, num)
+        with self._lock:
+            return self._smbus.read_i2c_block_data(addr, reg, num)
+
+    def probe_board_address(self, addr=0x14, fallback=0x15):
+        """Address of the robot HAT's MCU: addr if it acknowledges the probe writes (0x2C, 0, 0), fallback otherwise.
+        Only the first call in the process touches the bus; every PWM and ADC after that reuses the answer."""
+        with I2C._probe_lock:
+            if I2C._board_address is None:
+                try:
+                    self.send(0x2C, addr)
+                    self.send(0, addr)
+                    self.send(0, addr)
+                    I2C._board_address = addr
+                except IOError:
+                    I2C._board_address = fallback
+        return I2C._board_address
 
     def is_ready(self, addr):
         addresses = self.scan()
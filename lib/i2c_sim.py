@@ -2,17 +2,63 @@
 # -*- coding: utf-8 -*-
 
 # from .basic import _Basic_class
+import threading
+import multiprocessing
 from smbus import SMBus
 
+class BusLock(object):
+    """Reentrant lock for one bus, shared with forked processes. A process that is killed while holding it never
+    releases it, so reset() swaps in a new lock; threads waiting on the old one move over to it."""
+
+    def __init__(self):
+        self._lock = multiprocessing.get_context("fork").RLock()
+        self._held = threading.local()  # Per thread, the locks acquired and not yet released.
+
+    def __enter__(self):
+        lock = self._lock
+        while not lock.acquire(timeout=0.1):
+            lock = self._lock
+        self._held.__dict__.setdefault("locks", []).append(lock)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._held.locks.pop().release()
+
+    def reset(self):
+        self._lock = multiprocessing.get_context("fork").RLock()
+
+
+# Mirrors i2c.get_smbus: one lock per bus number, shared with forked processes. There are no handles to share here.
+_smbus_locks = {}
+_pool_lock = threading.Lock()
+
+def get_smbus(bus):
+    with _pool_lock:
+        if bus not in _smbus_locks:
+            _smbus_locks[bus] = BusLock()
+        return None, _smbus_locks[bus]
+
+def reset_locks():
+    """Replace every bus lock, after a process sharing them was killed, perhaps in the middle of a transaction."""
+    with _pool_lock:
+        for lock in _smbus_locks.values():
+            lock.reset()
+
+
 class I2C(object):
     MASTER = 0
     SLAVE  = 1
     RETRY = 5
 
+    # Address of the robot HAT's MCU, found once per process by probe_board_address.
+    _board_address = None
+    _probe_lock = threading.Lock()
+
     def __init__(self, *args, **kargs):     # *args表示位置参数（形式参数），可无，； **kargs表示默认值参数，可无。
         super().__init__()
         self._bus = 1
         # self._smbus = SMBus(self._bus)
+        self._smbus, self._lock = get_smbus(self._bus)
 
     def _i2c_write_byte(self, addr, data):   # i2C 写系列函数
         return 1
@@ -50,6 +96,20 @@ class I2C(object):
         # print('[_i2c_read_i2c_block_data] addr: {}, reg: {}, num: {}'.format(addr, reg, num))
         # return self._smbus.read_i2c_block_data(addr, reg, num)
 
+    def probe_board_address(self, addr=0x14, fallback=0x15):
+        """Address of the robot HAT's MCU: addr if it acknowledges the probe writes (0x2C, 0, 0), fallback otherwise.
+        Only the first call in the process touches the bus; every PWM and ADC after that reuses the answer."""
+        with I2C._probe_lock:
+            if I2C._board_address is None:
+                try:
+                    self.send(0x2C, addr)
+                    self.send(0, addr)
+                    self.send(0, addr)
+                    I2C._board_address = addr
+                except IOError:
+                    I2C._board_address = fallback
+        return I2C._board_address
+
     def is_ready(self, addr):
         addresses = self.scan()
         if addr in addresses:
@@ -4,7 +4,7 @@
 """Module with a controller class for the picar-x to be controlled to follow a line. """
 
 import picarx_improved
-import time
+import clock
 import numpy as np
 import atexit
 import line_following_interpreter as interp
@@ -18,14 +18,17 @@ logging.getLogger().setLevel(logging.DEBUG)
 
 class Controller(picarx_improved.Picarx):
     """Class for controlling the robot in a line following task."""
-    def __init__(self, car, pwm_percent = 30):
+    def __init__(self, car, pwm_percent = 30, move_ave_num = 1):
         super().__init__()
         self.car = car
         self.pwm_percent = pwm_percent
         self.dir_range = [-1, 1]
         self.steering_angle_range = [-90, 90]  # Range is larger than actual range of motion to allow for more responsiveness.
-        self.move_ave_num = 1
-        self.dir_vals = [0]*self.move_ave_num  # Queue used to smooth out direction commands.
+        self.move_ave_num = move_ave_num  # Number of steering commands averaged, see line_following_tuner.
+        # Last move_ave_num steering angles, starting out as zeros, averaged to smooth out direction commands. The
+        # window is preallocated and overwritten oldest first, which is cheaper per sample than a queue.
+        self.dir_vals = [0.0] * self.move_ave_num
+        self._dir_index = 0
         # Check in an obstacle was detected previously
         self.prev_obstacle = False
         self.waiting = False
@@ -34,6 +37,12 @@ class Controller(picarx_improved.Picarx):
         # Save time the obstacle 
         atexit.register(self.shutdown)
 
+    def _smooth_steering_angle(self,steering_angle):
+        """Add a steering angle to the window and return the average of the window."""
+        self.dir_vals[self._dir_index] = steering_angle
+        self._dir_index = (self._dir_index + 1) % self.move_ave_num
+        return sum(self.dir_vals) / self.move_ave_num
+
     def _get_steering_angle(self,direction):
         """Takes the "direction" from the interpreter and returns a steering angle for the car."""
         steering_angle = np.interp(direction, self.dir_range, self.steering_angle_range)
@@ -42,10 +51,8 @@ class Controller(picarx_improved.Picarx):
     def follow_line(self,direction):
         """Follow a line for one sample reading. """
         goal_steering_angle_raw = self._get_steering_angle(direction)
-        # add steering angle to a FIFO queue, and take average to smooth out commands.
-        self.dir_vals.append(goal_steering_angle_raw)
-        del self.dir_vals[0]
-        goal_steering_angle = np.average(self.dir_vals)
+        # add steering angle to the window, and take average to smooth out commands.
+        goal_steering_angle = self._smooth_steering_angle(goal_steering_angle_raw)
         self.car.set_dir_servo_angle(goal_steering_angle)
         self.car.forward(self.pwm_percent)
         return goal_steering_angle
@@ -53,10 +60,8 @@ class Controller(picarx_improved.Picarx):
     def follow_line_with_ultrasonic(self,direction,obstacle):
         """Follow a line for one sample reading. """
         goal_steering_angle_raw = self._get_steering_angle(direction)
-        # add steering angle to a FIFO queue, and take average to smooth out commands.
-        self.dir_vals.append(goal_steering_angle_raw)
-        del self.dir_vals[0]
-        goal_steering_angle = np.average(self.dir_vals)
+        # add steering angle to the window, and take average to smooth out commands.
+        goal_steering_angle = self._smooth_steering_angle(goal_steering_angle_raw)
         self.car.set_dir_servo_angle(goal_steering_angle)
         # Stop moving if obstacle was detected
         if obstacle:
@@ -66,11 +71,11 @@ class Controller(picarx_improved.Picarx):
         elif self.prev_obstacle and not obstacle and not self.waiting:
             logging.info("Obstacle was just removed. Start waiting.")
             self.waiting = True
-            self.start_waiting = time.time()
+            self.start_waiting = clock.time()
         # Break out of waiting if enough time has passed since obstacle was removed
         elif self.waiting:
             logging.info("Waiting.")
-            if time.time() - self.start_waiting >= self.wait_time:
+            if clock.time() - self.start_waiting >= self.wait_time:
                 logging.info("Break out of waiting.")
                 self.waiting = False
                 self.car.forward(self.pwm_percent)
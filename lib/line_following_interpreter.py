@@ -14,7 +14,156 @@ logging.getLogger().setLevel(logging.DEBUG)
 
 class Interpreter(object):
     """Class for interpreting the grayscale sensor data into a discrete position. Higher sensor numbers are lighter,
-    lower numbers are darker."""
+    lower numbers are darker. The moving-average buffer and all per-sensor terms are numpy arrays, so each sample is
+    handled with a few vectorized operations instead of a loop over the sensors."""
+
+    def __init__(self, proportional_gain=50,derivative_gain=5, line_polarity='darker'):
+        polarity_map = {'darker':1,'lighter':-1}
+        self.line_polarity = polarity_map[line_polarity]
+        if line_polarity == 'darker': self.mostly_under_func = np.argmin
+        else: self.mostly_under_func = np.argmax
+        self.p_gain = proportional_gain / 5000
+        self.d_gain = derivative_gain / 500
+        self.prop_vals = np.zeros(3)
+        self.moving_ave_num = 2  # Also allocates the buffers, see the setter.
+        self.line_centered = True
+
+    @property
+    def moving_ave_num(self):
+        return self._moving_ave_num
+
+    @moving_ave_num.setter
+    def moving_ave_num(self, value):
+        """Changing the window length reallocates the buffer, so it has to be refilled."""
+        self._moving_ave_num = value
+        self.reset()
+
+    def reset(self):
+        # Ring buffer of the last moving_ave_num samples, one row per sample. Rows are overwritten oldest first once
+        # the buffer is full; the order of the rows does not matter for the average.
+        self.running_data = np.zeros((self._moving_ave_num, 3))
+        self.buffer_size = 0
+        self.oldest_row = 0
+        self.running_aves = np.zeros(3)
+        self.deriv_vals = np.zeros(3)
+        self.buffer_full = False
+
+    def get_direction(self, sensor_data):
+        """Psuedo PD controller to turn sensor data into a direction value between -1 and 1, which is returned."""
+        mostly_under = self.mostly_under_func(self.running_aves)  # The sensor index the target is mostly under.
+        self.line_centered = True if mostly_under == 1 else False
+        if self.buffer_full: # A buffer us used to fill up queues of data to get more reliable readings.
+            self.running_data[self.oldest_row] = sensor_data
+            self.oldest_row = (self.oldest_row + 1) % self._moving_ave_num
+            ave = self.running_data.mean(axis=0)
+
+            """The derivative portion of the controller gives values to steer the car in response to the change
+            of the values. There are two relevant scenarios:
+            (1) The target is mostly under an outside sensor, and that sensor is seeing values that are changing away 
+            from the target (lighter/darker), and the center sensor is also not changing in the right way. 
+            In this case, if the outside sensor is turning less like the target it is about the lose the line (not moving
+            more centered over the line.) Need to steer strongly back towards the outside sensor with the target under it. 
+            (which is the opposite response given from case 2.)
+            (2) Else. In all other cases if the outside sensor is becoming less like the target sensor, it is already
+             changing in the right direction. Don't need to turn into the center even more. 
+            """
+            self.deriv_vals = (ave - self.running_aves) * self.d_gain * self.line_polarity * -1
+            self.running_aves = ave
+            # negative deriv_vals are changing to be more like the target. The /4 value is a hand picked threshold.
+            if not self.line_centered and self.deriv_vals[mostly_under] > 0 and self.deriv_vals[1] > -self.deriv_vals[mostly_under]/4:
+                # Case 1. The car is about to lose the line, which requires the opposite response.
+                self.deriv_vals = self.deriv_vals[::-1]  # Give the opposite response.
+            """The derivative portion of the controller is calculated at this point. Ex. [20,3,-6]. Alone this would result in 
+            a steering direction value towards the first sensor (20) and away from the third sensor (-6)."""
+        else:  # Buffer isn't full yet. Fill it.
+            buffer_size = self._add_to_buffer(sensor_data)
+            if buffer_size == self._moving_ave_num: self.buffer_full = True
+            direction = 0
+            return direction  # Return a neutral position until buffer fills.
+
+        # Proportional values: sensor averages times the polarity and p gain, adjusted down so the lowest value is zero.
+        # This makes the proportional value robust to different lighting conditions. Flipped, because that is the way
+        # it works out...
+        prop_vals = self.running_aves * self.line_polarity * self.p_gain
+        self.prop_vals = (prop_vals - prop_vals.min())[::-1]
+
+        # Add the proportional and derivative terms to get a reference direction.
+        raw_direction = self.prop_vals + self.deriv_vals
+        return self._transform_direction(raw_direction)
+
+    def process_batch(self, samples):
+        """Compute the direction for every row of an (N, 3) array of sensor samples in one go, e.g. to replay a logged
+        run while tuning gains. Equivalent to reset() followed by get_direction() on each row: the same buffer fill,
+        derivative reversal and clipping, the same values, and the interpreter is left in the same state."""
+        samples = np.asarray(samples, dtype=float)
+        n = len(samples)
+        m = self._moving_ave_num
+        self.reset()
+        directions = np.zeros(n)
+        if n == 0:
+            return directions
+
+        # Moving averages. Sample k always lands in buffer row k % m, so add up the rows in the same order that
+        # running_data.mean() does to get bit-identical averages.
+        t = np.arange(n)
+        count = np.minimum(t + 1, m)
+        sums = np.zeros((n, 3))
+        for row in range(m):
+            holder = t - ((t - row) % m)  # The sample sitting in this buffer row at step t.
+            in_buffer = row < count
+            sums[in_buffer] += samples[holder[in_buffer]]
+        aves = sums / count[:, None]
+        prev_aves = np.vstack((np.zeros((1, 3)), aves[:-1]))
+
+        # Steps after the buffer has filled.
+        full = slice(m, n)
+        deriv_vals = (aves[full] - prev_aves[full]) * self.d_gain * self.line_polarity * -1
+        mostly_under = self.mostly_under_func(prev_aves[full], axis=1)
+        rows = np.arange(len(deriv_vals))
+        deriv_under = deriv_vals[rows, mostly_under]
+        reverse = (mostly_under != 1) & (deriv_under > 0) & (deriv_vals[:, 1] > -deriv_under/4)
+        deriv_vals[reverse] = deriv_vals[reverse, ::-1]
+
+        prop_vals = aves[full] * self.line_polarity * self.p_gain
+        prop_vals = (prop_vals - prop_vals.min(axis=1, keepdims=True))[:, ::-1]
+        raw_direction = prop_vals + deriv_vals
+        directions[full] = np.clip((raw_direction[:, 2] - raw_direction[:, 0]) * self.line_polarity, -1, 1)
+
+        # Leave the interpreter as if each sample had gone through get_direction.
+        last = samples[max(0, n - m):]
+        self.running_data[np.arange(n - len(last), n) % m] = last
+        self.buffer_size = min(n, m)
+        self.buffer_full = n >= m
+        self.oldest_row = n % m if self.buffer_full else 0
+        self.running_aves = aves[-1]
+        self.line_centered = True if self.mostly_under_func(prev_aves[-1]) == 1 else False
+        if n > m:
+            self.deriv_vals = deriv_vals[-1]
+            self.prop_vals = prop_vals[-1]
+        else:
+            self.deriv_vals = aves[-1] - prev_aves[-1]
+        return directions
+
+    def _transform_direction(self,direction):
+        """Transform the PD controller reference direction (3 number array) to a single number between -1 and 1. The
+        outer sensors count with opposite signs and the center sensor is ignored."""
+        direction = (direction[2] - direction[0]) * self.line_polarity
+        if direction < -1: direction = -1
+        if direction > 1: direction = 1
+        return direction
+
+    def _add_to_buffer(self, sensor_data):
+        self.running_data[self.buffer_size] = sensor_data
+        self.buffer_size += 1
+        ave = self.running_data[:self.buffer_size].mean(axis=0)
+        self.deriv_vals = ave - self.running_aves
+        self.running_aves = ave
+        return self.buffer_size
+
+
+class _ListInterpreter(object):
+    """The original list-based implementation of Interpreter. Kept as the reference that benchmark() and test() compare
+    the vectorized Interpreter against; not meant for use on the car."""
 
     def __init__(self, proportional_gain=50,derivative_gain=5, line_polarity='darker'):
         polarity_map = {'darker':1,'lighter':-1}
@@ -104,17 +253,50 @@ class Interpreter(object):
         return buffer_size
 
 
+TEST_DATA = [[191, 223, 210],[181, 230, 214],[185, 224, 207],[184, 225, 211],[187, 224, 211],[186, 233, 205],
+             [181, 232, 206],[190, 226, 210],[187, 226, 211],[182, 229, 213],[184, 229, 211],[185, 231, 210],
+             [190, 227, 207],[187, 230, 210],[185, 227, 210]]
+
 def test():
-    data = [[191, 223, 210],[181, 230, 214],[185, 224, 207],[184, 225, 211],[187, 224, 211],[186, 233, 205],
-            [181, 232, 206],[190, 226, 210],[187, 226, 211],[182, 229, 213],[184, 229, 211],[185, 231, 210],
-            [190, 227, 207],[187, 230, 210],[185, 227, 210]]
+    data = TEST_DATA
     interpreter = Interpreter()
+    reference = _ListInterpreter()
     for i in range(len(data)):
-        print(interpreter.get_direction(data[i]))
+        direction = interpreter.get_direction(data[i])
+        assert direction == reference.get_direction(data[i])
+        print(direction)
+
+def test_batch(samples=100000):
+    """Check process_batch against get_direction on a synthetic log, and time it."""
+    rng = np.random.default_rng(0)
+    data = rng.integers(150, 250, size=(samples, 3))
+    interpreter = Interpreter(proportional_gain=10, derivative_gain=1)
+    t_start = time.perf_counter()
+    directions = interpreter.process_batch(data)
+    batch_time = time.perf_counter() - t_start
+    reference = Interpreter(proportional_gain=10, derivative_gain=1)
+    for i in range(min(samples, 5000)):
+        assert directions[i] == reference.get_direction(data[i])
+    print("process_batch: {} samples in {:.3f} s".format(samples, batch_time))
+    return batch_time
+
+def benchmark(calls=20000):
+    """Compare get_direction calls/second of the vectorized Interpreter and the original list-based version."""
+    rates = {}
+    for name, interpreter_class in (("list-based", _ListInterpreter), ("vectorized", Interpreter)):
+        interpreter = interpreter_class(proportional_gain=10, derivative_gain=1)
+        t_start = time.perf_counter()
+        for i in range(calls):
+            interpreter.get_direction(TEST_DATA[i % len(TEST_DATA)])
+        rates[name] = calls / (time.perf_counter() - t_start)
+        print("{:>10s}: {:10.0f} calls/s".format(name, rates[name]))
+    return rates
 
 def main():
     logging.getLogger().setLevel(logging.INFO)
     test()
+    test_batch()
+    benchmark()
 
 if __name__ == '__main__':
     main()
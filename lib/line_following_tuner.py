@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Gain-sweep tuner for the line following interpreter and controller. Replays a recorded grayscale log through every
+combination of interpreter gains and moving-average lengths in a process pool, scores each configuration for how far
+its steering is from the line position and how much it oscillates, and caches the scores on disk, keyed by a hash of
+the log, the cost function version and the parameters, so that rerunning with a larger grid only evaluates the new
+configurations. The best configuration is deployed as Interpreter(proportional_gain, derivative_gain) with
+moving_ave_num set, and Controller(car, move_ave_num=control_move_ave_num)."""
+
+import argparse
+import concurrent.futures
+import hashlib
+import itertools
+import json
+import os
+import time
+import numpy as np
+import line_following_interpreter as interp
+import logging
+logging.basicConfig(format="%(asctime)s:%(message)s", level=logging.INFO, datefmt="%H:%M:%S")
+
+DEFAULT_GRID = {
+    "proportional_gain": [1, 3, 5, 10, 20, 50],
+    "derivative_gain": [0, 1, 5, 10],
+    "moving_ave_num": [1, 2, 3, 5],            # Interpreter.moving_ave_num
+    "control_move_ave_num": [1, 2, 3, 5],      # Controller.move_ave_num
+}
+# Bump whenever evaluate() changes, so scores cached under an older cost function are not mixed with new ones.
+COST_VERSION = 2
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'line_following_tuner')
+
+
+def load_log(path):
+    """Load an (N, 3) grayscale log saved with np.save (.npy) or as comma separated text."""
+    if path.endswith('.npy'):
+        samples = np.load(path)
+    else:
+        samples = np.loadtxt(path, delimiter=',', ndmin=2)
+    return np.asarray(samples, dtype=float)[:, :3]
+
+
+def log_hash(samples, line_polarity):
+    digest = hashlib.sha1(np.ascontiguousarray(samples, dtype=float).tobytes())
+    digest.update(line_polarity.encode())
+    return digest.hexdigest()
+
+
+def steering_angles(directions, move_ave_num, dir_range=(-1, 1), steering_angle_range=(-90, 90)):
+    """Steering angles the Controller would command for a direction trace: mapped to an angle like
+    Controller._get_steering_angle, then averaged over the last move_ave_num commands, starting from zeros."""
+    raw = np.interp(directions, dir_range, steering_angle_range)
+    padded = np.concatenate((np.zeros(move_ave_num), raw))
+    csum = np.cumsum(padded)
+    return (csum[move_ave_num:] - csum[:-move_ave_num]) / move_ave_num
+
+
+def line_offset(samples, line_polarity='darker'):
+    """Position of the line under the sensors for each sample, from -1 (under sensor 0) to 1 (under sensor 2): the
+    contrast-weighted mean of the sensor positions. 0 where the sensors see no contrast."""
+    if line_polarity == 'darker':
+        contrast = samples.max(axis=1, keepdims=True) - samples
+    else:
+        contrast = samples - samples.min(axis=1, keepdims=True)
+    total = contrast.sum(axis=1)
+    return np.where(total > 0, contrast @ np.array([-1.0, 0.0, 1.0]) / np.where(total > 0, total, 1), 0.0)
+
+
+def evaluate(config, samples, line_polarity='darker'):
+    """Score one configuration on a log. Lower cost is better; cost is tracking_error + oscillation.
+
+    tracking_error: mean absolute difference between the commanded steering angle and the angle the Controller would
+    command for the line offset itself (line_offset mapped like Controller._get_steering_angle), as a fraction of the
+    full steering range. Too little gain, too much smoothing and overshoot all add to it.
+    oscillation: mean absolute change of the steering angle per sample, as a fraction of the full steering range.
+    off_line: fraction of samples where the line is under an outer sensor but the car is not steering towards it.
+    Reported only; it ignores how far the car steers."""
+    interpreter = interp.Interpreter(proportional_gain=config["proportional_gain"],
+                                     derivative_gain=config["derivative_gain"], line_polarity=line_polarity)
+    interpreter.moving_ave_num = config["moving_ave_num"]
+    directions = interpreter.process_batch(samples)
+    angles = steering_angles(directions, config["control_move_ave_num"])
+
+    target = np.interp(line_offset(samples, line_polarity), (-1, 1), (-90, 90))
+    tracking_error = float(np.mean(np.abs(angles - target))) / 180 if len(angles) else 0.0
+    oscillation = float(np.mean(np.abs(np.diff(angles)))) / 180 if len(angles) > 1 else 0.0
+    # Which sensor the line is under: -1 for sensor 0 (steer negative), 0 for the center, 1 for sensor 2.
+    under = np.argmin(samples, axis=1) if line_polarity == 'darker' else np.argmax(samples, axis=1)
+    side = under - 1
+    off_line = float(np.mean((side != 0) & (np.sign(angles) != side)))
+    return {"config": config, "cost": tracking_error + oscillation, "tracking_error": tracking_error,
+            "oscillation": oscillation, "off_line": off_line}
+
+
+# Each pool worker receives the log once, through the initializer, rather than with every task.
+_worker_samples = None
+_worker_polarity = None
+
+def _init_worker(samples, line_polarity):
+    global _worker_samples, _worker_polarity
+    _worker_samples = samples
+    _worker_polarity = line_polarity
+
+def _evaluate_in_worker(config):
+    return evaluate(config, _worker_samples, _worker_polarity)
+
+
+def config_key(config):
+    return json.dumps(config, sort_keys=True)
+
+
+def grid_configs(grid):
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def sweep(samples, grid=None, line_polarity='darker', cache_dir=DEFAULT_CACHE_DIR, workers=None):
+    """Evaluate every configuration in the grid on the log and return the results sorted by cost. Results already in
+    the cache for this log are reused; new ones are computed in a process pool and added to the cache."""
+    grid = DEFAULT_GRID if grid is None else grid
+    samples = np.asarray(samples, dtype=float)
+    configs = grid_configs(grid)
+
+    cache = {}
+    cache_path = None
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        cache_path = os.path.join(cache_dir, "{}-cost{}.json".format(log_hash(samples, line_polarity), COST_VERSION))
+        if os.path.exists(cache_path):
+            with open(cache_path) as f:
+                cache = json.load(f)
+
+    todo = [config for config in configs if config_key(config) not in cache]
+    logging.info("Tuner: {} configurations, {} cached, {} to evaluate".format(
+        len(configs), len(configs) - len(todo), len(todo)))
+    if todo:
+        t_start = time.perf_counter()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                    initargs=(samples, line_polarity)) as executor:
+            for result in executor.map(_evaluate_in_worker, todo, chunksize=max(1, len(todo) // 64)):
+                cache[config_key(result["config"])] = result
+        logging.info("Tuner: evaluated {} configurations in {:.2f} s".format(len(todo), time.perf_counter() - t_start))
+        if cache_path:
+            # Write to a temporary file first so an interrupted run never leaves a corrupt cache.
+            with open(cache_path + '.tmp', 'w') as f:
+                json.dump(cache, f)
+            os.replace(cache_path + '.tmp', cache_path)
+
+    return sorted((cache[config_key(config)] for config in configs), key=lambda result: result["cost"])
+
+
+def report(results, top=10):
+    print("{:>6s} {:>6s} {:>4s} {:>4s} | {:>8s} {:>8s} {:>11s} {:>8s}".format(
+        "P", "D", "ave", "ctrl", "cost", "tracking", "oscillation", "off_line"))
+    for result in results[:top]:
+        config = result["config"]
+        print("{:6g} {:6g} {:4d} {:4d} | {:8.4f} {:8.4f} {:11.4f} {:8.4f}".format(
+            config["proportional_gain"], config["derivative_gain"], config["moving_ave_num"],
+            config["control_move_ave_num"], result["cost"], result["tracking_error"], result["oscillation"],
+            result["off_line"]))
+
+
+def synthetic_log(samples=2000, period=200, amplitude=1.3, seed=0):
+    """Grayscale log of a dark line swinging sinusoidally across and past all three sensors, with sensor noise."""
+    rng = np.random.default_rng(seed)
+    position = amplitude * np.sin(np.arange(samples) * 2 * np.pi / period)
+    distance = np.abs(position[:, None] - np.array([-1, 0, 1]))
+    return 1400 - 1000 * np.exp(-(distance / 0.5) ** 2) + rng.normal(0, 20, (samples, 3))
+
+
+def test():
+    """Check that the sweep tells settings apart on a synthetic log: the lowest gain must not win, and more gain
+    than the smallest must track the line better."""
+    results = sweep(synthetic_log(), cache_dir=None)
+    best = results[0]
+    assert best["config"]["proportional_gain"] > min(DEFAULT_GRID["proportional_gain"]), best
+    weakest = [r for r in results if r["config"]["proportional_gain"] == min(DEFAULT_GRID["proportional_gain"])]
+    assert best["tracking_error"] < min(r["tracking_error"] for r in weakest)
+    report(results, 5)
+    print("Tuner tests passed.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep line following gains over a recorded grayscale log.")
+    parser.add_argument("log", help="(N, 3) grayscale log, .npy or comma separated text")
+    parser.add_argument("--polarity", default="darker", choices=["darker", "lighter"])
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+    results = sweep(load_log(args.log), line_polarity=args.polarity, cache_dir=args.cache_dir, workers=args.workers)
+    report(results, args.top)
+
+if __name__ == '__main__':
+    main()
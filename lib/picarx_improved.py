@@ -13,17 +13,18 @@ if platform.node() == 'raspberrypi' or platform.node() == 'cecilia':  # Import r
     
     print("importing raspi classes")
     from servo import Servo
-    from pwm import PWM
+    from pwm import PWM, PWMGroup
     from pin import Pin
     from adc import ADC
     from filedb import fileDB
 else: # Not being run on the raspberry pi. Import simulation classes.
     print("importing simulation classes")
     from servo_sim import Servo
-    from pwm_sim import PWM
+    from pwm_sim import PWM, PWMGroup
     from pin_sim import Pin
     from adc_sim import ADC
     from filedb_sim import fileDB
+import ultrasonic
 # from utils import reset_mcu
 # reset_mcu()
 import logging
@@ -58,14 +59,17 @@ class Picarx(object):
         self.S0 = ADC('A0')
         self.S1 = ADC('A1')
         self.S2 = ADC('A2')
+        self.sonar = ultrasonic.get_sensor('D8', 'D9', timeout=0.01)  # Shared by every Picarx in the process.
         self.turn_limit = 30
-        self.stop == False
+        self.stopped = False  # Set by stop(); forward() does nothing afterwards.
 
         self.motor_direction_pins = [self.left_rear_dir_pin, self.right_rear_dir_pin]
         self.motor_speed_pins = [self.left_rear_pwm_pin, self.right_rear_pwm_pin]
         for pin in self.motor_speed_pins:
             pin.period(self.PERIOD)
             pin.prescaler(self.PRESCALER)
+        # Both rear motors are updated together, in one I2C transaction where the MCU allows it.
+        self.motor_group = PWMGroup(*self.motor_speed_pins)
         self.cali_dir_value = self.config_file_obj.get("picarx_dir_motor", default_value="[1,1]")
         self.cali_dir_value = [int(i.strip()) for i in self.cali_dir_value.strip("[]").split(",")]
         self.cali_speed_value = [0, 0]
@@ -77,6 +81,16 @@ class Picarx(object):
     @log_on_start(logging.DEBUG, "[set_motor_speed] motor: {motor}, speed: {speed}")
     @log_on_error(logging.DEBUG, "[set_motor_speed] Error")
     def set_motor_speed(self,motor,speed):
+        self._stage_motor_speed(motor, speed)
+        self.motor_group.flush()
+
+    def _set_motor_speeds(self,left_speed,right_speed,force=False):
+        """Set both rear motors and send the two PWM values together. force sends them even if they look unchanged."""
+        self._stage_motor_speed(1, left_speed, force)
+        self._stage_motor_speed(2, right_speed, force)
+        self.motor_group.flush()
+
+    def _stage_motor_speed(self,motor,speed,force=False):
         #todo what are the units of speed???
         motor -= 1
         if speed >= 0:
@@ -90,10 +104,9 @@ class Picarx(object):
         speed = speed - self.cali_speed_value[motor]
         if direction < 0:
             self.motor_direction_pins[motor].high()
-            self.motor_speed_pins[motor].pulse_width_percent(speed)
         else:
             self.motor_direction_pins[motor].low()
-            self.motor_speed_pins[motor].pulse_width_percent(speed)
+        self.motor_group.pulse_width_percent(self.motor_speed_pins[motor], speed, force)
 
     @log_on_start(logging.DEBUG, "[motor_speed_calibration] value: {value}")
     @log_on_error(logging.DEBUG, "[motor_speed_calibration] Error")
@@ -137,7 +150,7 @@ class Picarx(object):
         # print("angle_value:",angle_value)
         # # print("set_dir_servo_angle_1:",angle_value)
         # # print("set_dir_servo_angle_2:",dir_cal_value)
-        self.servo_dir.angle(angle_value)
+        self.servo_dir.angle_fast(angle_value)
 
     @log_on_start(logging.DEBUG, "[camera_servo1_angle_calibration] value: {value}")
     @log_on_error(logging.DEBUG, "[camera_servo1_angle_calibration] Error")
@@ -158,7 +171,7 @@ class Picarx(object):
     @log_on_start(logging.DEBUG, "[set_camera_servo1_angle] value: {value}")
     @log_on_error(logging.DEBUG, "[set_camera_servo1_angle] Error")
     def set_camera_servo1_angle(self,value):
-        self.servo_camera_pan.angle(-1*(value + -1*self.cam_cal_value_pan))
+        self.servo_camera_pan.angle_fast(-1*(value + -1*self.cam_cal_value_pan))
         # print("self.cam_cal_value_pan:",self.cam_cal_value_pan)
         # print((value + self.cam_cal_value_pan))
 
@@ -166,7 +179,7 @@ class Picarx(object):
     @log_on_error(logging.DEBUG, "[set_camera_servo2_angle] Error")
     def set_camera_servo2_angle(self,value):
         # global cam_cal_value_tilt
-        self.servo_camera_tilt.angle(-1*(value + -1*self.cam_cal_value_tilt))
+        self.servo_camera_tilt.angle_fast(-1*(value + -1*self.cam_cal_value_tilt))
         # print("self.cam_cal_value_tilt:",self.cam_cal_value_tilt)
         # print((value + self.cam_cal_value_tilt))
 
@@ -174,17 +187,12 @@ class Picarx(object):
     @log_on_error(logging.DEBUG, "[get_adc_value] Error")
     @log_on_end(logging.DEBUG, "[get_adc_value] Result: {result}")
     def get_adc_value(self):
-        adc_value_list = []
-        adc_value_list.append(self.S0.read())
-        adc_value_list.append(self.S1.read())
-        adc_value_list.append(self.S2.read())
-        return adc_value_list
+        return self.S0.read_many(['A0', 'A1', 'A2'])
 
     @log_on_start(logging.DEBUG, "[set_power] speed: {speed}")
     @log_on_error(logging.DEBUG, "[set_power] Error")
     def set_power(self,speed):
-        self.set_motor_speed(1, speed)
-        self.set_motor_speed(2, speed) 
+        self._set_motor_speeds(speed, speed)
 
     @log_on_start(logging.DEBUG, "[backward] speed: {speed}")
     @log_on_error(logging.DEBUG, "[backward] Error")
@@ -198,24 +206,20 @@ class Picarx(object):
             power_scale = (100 - abs_current_angle) / 100.0 
             # print("power_scale:",power_scale)
             if (current_angle / abs_current_angle) > 0:
-                self.set_motor_speed(1, -1*speed)
-                self.set_motor_speed(2, speed * power_scale)
+                self._set_motor_speeds(-1*speed, speed * power_scale)
             else:
-                self.set_motor_speed(1, -1*speed * power_scale)
-                self.set_motor_speed(2, speed )
+                self._set_motor_speeds(-1*speed * power_scale, speed)
         else:
-            self.set_motor_speed(1, -1*speed)
-            self.set_motor_speed(2, speed)  
+            self._set_motor_speeds(-1*speed, speed)
 
     @log_on_start(logging.DEBUG, "[forward] speed: {speed}")
     @log_on_error(logging.DEBUG, "[forward] Error")
     def forward(self,speed):
-        if self.stop == True:
+        if self.stopped:
             return
         current_angle = self.dir_current_angle
         if current_angle == 0: # Both motors go same speed.
-            self.set_motor_speed(1, speed)
-            self.set_motor_speed(2, -1 * speed)
+            self._set_motor_speeds(speed, -1 * speed)
         else: # Motors need different speeds to not slip.
             # If the steering angle is 90 deg to the right, the left wheel should move at the forward speed while the
             # right should not move (scaled to zero). A linear interpolation between directly forward and a 90 degree
@@ -228,47 +232,22 @@ class Picarx(object):
             # power_scale = (100 - abs_current_angle) / 100.0
             # # print("power_scale:",power_scale)
             if (current_angle / abs_current_angle) > 0: # Turning right
-                self.set_motor_speed(1, speed)
-                self.set_motor_speed(2, -1*scaled_speed)
+                self._set_motor_speeds(speed, -1*scaled_speed)
             else: # Turning left
-                self.set_motor_speed(1, scaled_speed)
-                self.set_motor_speed(2, -1*speed )
+                self._set_motor_speeds(scaled_speed, -1*speed)
 
     @log_on_start(logging.DEBUG, "[stop] Enter")
     @log_on_error(logging.DEBUG, "[stop] Error")
     def stop(self):
-        self.set_motor_speed(1, 0)
-        self.set_motor_speed(2, 0)
-        self.stop=True
+        self._set_motor_speeds(0, 0, force=True)  # Never left to the write cache or the deadband.
+        self.stopped = True
 
     @log_on_start(logging.DEBUG, "[Get_distance] Enter")
     @log_on_error(logging.DEBUG, "[Get_distance] Error")
     @log_on_end(logging.DEBUG, "[Get_distance] Result: {result}")
     def Get_distance(self):
-        timeout=0.01
-        trig = Pin('D8')
-        echo = Pin('D9')
-
-        trig.low()
-        time.sleep(0.01)
-        trig.high()
-        time.sleep(0.000015)
-        trig.low()
-        pulse_end = 0
-        pulse_start = 0
-        timeout_start = time.time()
-        while echo.value()==0:
-            pulse_start = time.time()
-            if pulse_start - timeout_start > timeout:
-                return -1
-        while echo.value()==1:
-            pulse_end = time.time()
-            if pulse_end - timeout_start > timeout:
-                return -2
-        during = pulse_end - pulse_start
-        cm = round(during * 340 / 2 * 100, 2)
-        #print(cm)
-        return cm
+        # Shares the sonar's pins and, once self.sonar is ranging (e.g. in a ultrasonic.Ranger), its latest result.
+        return self.sonar.measure()
 
     @log_on_start(logging.DEBUG, "[shutdown] Enter")
     def cleanup(self):
@@ -171,7 +171,13 @@ class Pin(object):
 
     def irq(self, handler=None, trigger=None, bouncetime=200):
         self.mode(self.IN)
-        GPIO.add_event_detect(self._pin, trigger, callback=handler, bouncetime=bouncetime)
+        if bouncetime:
+            GPIO.add_event_detect(self._pin, trigger, callback=handler, bouncetime=bouncetime)
+        else:  # RPi.GPIO rejects a zero bouncetime, so leave it out to see every edge.
+            GPIO.add_event_detect(self._pin, trigger, callback=handler)
+
+    def irq_remove(self):
+        GPIO.remove_event_detect(self._pin)
 
     def name(self):
         return "GPIO%s"%self._pin
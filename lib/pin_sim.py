@@ -144,6 +144,7 @@ class Pin(object):
         else:
             value = value[0]
             self.mode(self.OUT)
+            self._value = value  # Kept so the track simulator can see motor direction pins.
             # GPIO.output(self._pin, value)
             return value
 
@@ -172,8 +173,13 @@ class Pin(object):
 
     def irq(self, handler=None, trigger=None, bouncetime=200):
         self.mode(self.IN)
+        self._irq_handler = handler  # Kept so a simulation can fire edges with pin._irq_handler(pin._pin).
         # GPIO.add_event_detect(self._pin, trigger, callback=handler, bouncetime=bouncetime)
 
+    def irq_remove(self):
+        self._irq_handler = None
+        # GPIO.remove_event_detect(self._pin)
+
     def name(self):
         return "GPIO%s"%self._pin
 
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import smbus, math
+import math
+import os
 from i2c_sim import I2C
 
 timer = [
@@ -10,6 +11,21 @@ timer = [
     }
 ] * 4
 
+# (clock, frequency) -> (prescaler, period) chosen by PWM.freq, shared by every channel in the process.
+_freq_settings = {}
+
+# Last value written to each (board address, register) by any PWM in the process, so that repeating a command does not
+# cost an I2C transfer. Timer registers are shared between channels, and several objects may drive the same channel.
+# Checks and updates happen under the bus lock. Other processes can write the board behind this cache's back, so it is
+# cleared in every forked child, and rossros.runInProcesses clears it again once its stages have exited.
+_written = {}
+
+def invalidate():
+    """Forget which register values were written, so the next commands are all sent. utils.reset_mcu calls this."""
+    _written.clear()
+
+os.register_at_fork(after_in_child=invalidate)
+
 class PWM(I2C):
     REG_CHN = 0x20
     REG_FRE = 0x30
@@ -20,6 +36,10 @@ class PWM(I2C):
 
     CLOCK = 72000000
 
+    # Set to True on MCU firmware that auto-increments the register address during a block write, so that PWMGroup
+    # can update consecutive channels in one bus transaction.
+    BLOCK_WRITE = False
+
     def __init__(self, channel, debug="critical"):
         super().__init__()
         if isinstance(channel, str):
@@ -27,55 +47,77 @@ class PWM(I2C):
                 channel = int(channel[1:])
             else:
                 raise ValueError("PWM channel should be between [P1, P14], not {0}".format(channel))
-        try:
-            self.send(0x2C, self.ADDR)
-            self.send(0, self.ADDR)
-            self.send(0, self.ADDR)
-        except IOError:
-            self.ADDR = 0x15
+        self.ADDR = self.probe_board_address(self.ADDR)
 
         self.debug = debug
         # self._debug("PWM address: {:02X}".format(self.ADDR))
         self.channel = channel
         self.timer = int(channel/4)
-        # self.bus = smbus.SMBus(1)
         self._pulse_width = 0
         self._freq = 50
+        # Pulse width changes of at most this many timer counts are not sent, see _written. 0 only skips exact repeats.
+        # Turning a channel off is always sent.
+        self.deadband = 0
         self.freq(50)
 
-    def i2c_write(self, reg, value):
-        value_h = value >> 8
-        value_l = value & 0xff
-        # self._debug("i2c write: [0x%02X, 0x%02X, 0x%02X, 0x%02X]"%(self.ADDR, reg, value_h, value_l))
-        self.send([reg, value_h, value_l], self.ADDR)
+    def i2c_write(self, reg, value, force=False):
+        key = (self.ADDR, reg)
+        with self._lock:
+            if not force and _written.get(key) == value:
+                return
+            value_h = value >> 8
+            value_l = value & 0xff
+            # self._debug("i2c write: [0x%02X, 0x%02X, 0x%02X, 0x%02X]"%(self.ADDR, reg, value_h, value_l))
+            self.send([reg, value_h, value_l], self.ADDR)
+            _written[key] = value
+
+    def invalidate(self):
+        """Forget which register values were written, e.g. after an MCU reset, so the next commands are all sent."""
+        invalidate()
+
+    def _needs_write(self, value, force=False):
+        """Whether pulse width value has to be sent: when forced, when it leaves the deadband around the last value
+        written, and whenever it turns the channel off. Call with the bus lock held."""
+        last = _written.get((self.ADDR, self.REG_CHN + self.channel))
+        if force or last is None:
+            return True
+        if value == 0:
+            return last != 0
+        return abs(value - last) > self.deadband
 
     def freq(self, *freq):
         if len(freq) == 0:
             return self._freq
         else:
             self._freq = int(freq[0])
-            # [prescaler,arr] list
-            result_ap = []
-            # accuracy list
-            result_acy = []
-            # middle value for equal arr prescaler
-            st = int(math.sqrt(self.CLOCK/self._freq))
-            # get -5 value as start
-            st -= 5
-            # prevent negetive value
-            if st <= 0:
-                st = 1
-            for psc in range(st,st+10):
-                arr = int(self.CLOCK/self._freq/psc)
-                result_ap.append([psc, arr])
-                result_acy.append(abs(self._freq-self.CLOCK/psc/arr))
-            i = result_acy.index(min(result_acy))
-            psc = result_ap[i][0]
-            arr = result_ap[i][1]
+            key = (self.CLOCK, self._freq)
+            if key not in _freq_settings:
+                _freq_settings[key] = self._solve_freq()
+            psc, arr = _freq_settings[key]
             # self._debug("prescaler: %s, period: %s"%(psc, arr))
             self.prescaler(psc)
             self.period(arr)
 
+    def _solve_freq(self):
+        """Search the prescalers around sqrt(CLOCK / freq) for the (prescaler, period) pair closest to the frequency."""
+        # [prescaler,arr] list
+        result_ap = []
+        # accuracy list
+        result_acy = []
+        # middle value for equal arr prescaler
+        st = int(math.sqrt(self.CLOCK/self._freq))
+        # get -5 value as start
+        st -= 5
+        # prevent negetive value
+        if st <= 0:
+            st = 1
+        for psc in range(st,st+10):
+            arr = int(self.CLOCK/self._freq/psc)
+            result_ap.append([psc, arr])
+            result_acy.append(abs(self._freq-self.CLOCK/psc/arr))
+        i = result_acy.index(min(result_acy))
+        return result_ap[i][0], result_ap[i][1]
+
     def prescaler(self, *prescaler):
         if len(prescaler) == 0:
             return self._prescaler
@@ -95,13 +137,16 @@ class PWM(I2C):
             # self._debug("Set arr to: %s"%timer[self.timer]["arr"])
             self.i2c_write(reg, timer[self.timer]["arr"])
 
-    def pulse_width(self, *pulse_width):
+    def pulse_width(self, *pulse_width, force=False):
         if len(pulse_width) == 0:
             return self._pulse_width
         else:
-            self._pulse_width = int(pulse_width[0])
-            reg = self.REG_CHN + self.channel
-            self.i2c_write(reg, self._pulse_width)
+            value = int(pulse_width[0])
+            with self._lock:
+                if not self._needs_write(value, force):
+                    return
+                self._pulse_width = value
+                self.i2c_write(self.REG_CHN + self.channel, value, force)
 
     def pulse_width_percent(self, *pulse_width_percent):
         global timer
@@ -114,7 +159,61 @@ class PWM(I2C):
             pulse_width = temp * timer[self.timer]["arr"]
             self.pulse_width(pulse_width)
 
-        
+
+
+class PWMGroup(object):
+    """PWM channels on one board whose pulse widths are staged and then sent together by flush(), e.g. both rear
+    motors, so they change at the same moment. With PWM.BLOCK_WRITE each run of consecutive channels goes out as a
+    single block write; otherwise the channels are written back to back. Unchanged channels are skipped as usual,
+    unless staged with force=True."""
+
+    def __init__(self, *pwms):
+        self.pwms = sorted(pwms, key=lambda pwm: pwm.channel)
+        self._staged = {}
+
+    def pulse_width(self, pwm, pulse_width, force=False):
+        self._staged[pwm] = (int(pulse_width), force)
+
+    def pulse_width_percent(self, pwm, pulse_width_percent, force=False):
+        pwm._pulse_width_percent = pulse_width_percent
+        self._staged[pwm] = (int(pulse_width_percent / 100.0 * timer[pwm.timer]["arr"]), force)
+
+    def flush(self):
+        # The channels share one bus, so one lock covers deciding what changed and writing it.
+        with self.pwms[0]._lock:
+            changed = []
+            for pwm in self.pwms:
+                if pwm not in self._staged:
+                    continue
+                value, force = self._staged.pop(pwm)
+                if pwm._needs_write(value, force):
+                    changed.append((pwm, value))
+            if not changed:
+                return
+            if not PWM.BLOCK_WRITE:
+                for pwm, value in changed:
+                    pwm.pulse_width(value, force=True)
+                return
+            run = [changed[0]]
+            for pwm, value in changed[1:]:
+                if pwm.channel == run[-1][0].channel + 1 and pwm.ADDR == run[-1][0].ADDR:
+                    run.append((pwm, value))
+                else:
+                    self._write_run(run)
+                    run = [(pwm, value)]
+            self._write_run(run)
+
+    def _write_run(self, run):
+        first = run[0][0]
+        data = []
+        for pwm, value in run:
+            data += [value >> 8, value & 0xff]
+        first._i2c_write_i2c_block_data(first.ADDR, first.REG_CHN + first.channel, data)
+        for pwm, value in run:
+            pwm._pulse_width = value
+            _written[(pwm.ADDR, pwm.REG_CHN + pwm.channel)] = value
+
+
 def test():
     import time
     p = PWM(0)
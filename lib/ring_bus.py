@@ -0,0 +1,92 @@
+"""Contains a bus that keeps a history window of its most recent messages in a preallocated numpy array."""
+
+import clock
+import numpy as np
+from bus import BusInterface
+
+
+class RingBus(BusInterface):
+    """Bus holding the last `size` messages, each a number or a fixed-shape array, for one writer and many readers.
+
+    Every message is stored twice, `size` slots apart, in an array of length 2*size. That way the most recent n
+    messages are always one contiguous slice, so latest(), window(n) and since(seq) return read-only views without
+    copying, and consumers can average or difference over the window in a single numpy call. A view is only valid until
+    the writer wraps around to the slots it covers; copy it if it has to outlive the next `size` writes."""
+
+    def __init__(self, size=10, shape=(), dtype=np.float64, initial_message=None, name="Unnamed Ring Bus"):
+        self.size = size
+        self.name = name
+        self.listeners = []
+        self._data = np.zeros((2 * size,) + tuple(shape), dtype=dtype)
+        self._stamps = np.zeros(2 * size)
+        self.seq = 0  # Number of messages written so far.
+        if initial_message is not None:
+            self.write(initial_message)
+
+    @property
+    def timestamp(self):
+        """clock.time() at which the latest message was written."""
+        return self._stamps[(self.seq - 1) % self.size] if self.seq else 0.0
+
+    @property
+    def message(self):
+        return self.read()
+
+    def write(self,msg):
+        i = self.seq % self.size
+        now = clock.time()
+        self._data[i] = msg
+        self._data[i + self.size] = msg
+        self._stamps[i] = now
+        self._stamps[i + self.size] = now
+        self.seq += 1  # Publish only once both copies are in place.
+        for condition in self.listeners:
+            with condition:
+                condition.notify_all()
+
+    def clear(self):
+        """Forget every message written so far. Sequence numbers start again from 0."""
+        self.seq = 0
+
+    def _bounds(self,n,seq=None):
+        """Slice bounds of the last n messages up to message number seq (the latest by default), capped by size."""
+        if seq is None:
+            seq = self.seq
+        n = max(0, min(n, self.size, seq))
+        end = (seq - 1) % self.size + self.size + 1
+        return end - n, end
+
+    def _view(self,array,n,seq=None):
+        start, end = self._bounds(n, seq)
+        view = array[start:end]
+        view.flags.writeable = False
+        return view
+
+    def latest(self):
+        """The most recent message (a read-only view for array messages), or None if nothing was written yet."""
+        if not self.seq:
+            return None
+        return self._view(self._data, 1)[0]
+
+    def read(self):
+        return self.latest()
+
+    def window(self,n=None):
+        """Read-only view of the last n messages (all retained ones by default), oldest first."""
+        return self._view(self._data, self.size if n is None else n)
+
+    def timestamps(self,n=None):
+        """Read-only view of the write times matching window(n)."""
+        return self._view(self._stamps, self.size if n is None else n)
+
+    def since(self,seq):
+        """Read-only view of the messages written after sequence number seq, limited to the retained window."""
+        return self.window(self.seq - seq)
+
+    def read_since(self,seq):
+        """Like since(seq), but also return the sequence number the view ends at, to pass to the next call."""
+        current = self.seq
+        return self._view(self._data, current - seq, current), current
+
+    def changed_since(self,seq):
+        return self.seq > seq
@@ -1,7 +1,16 @@
 #! /usr/bin/python3
+import collections
 import concurrent.futures
+import multiprocessing
+import multiprocessing.connection
+import pickle
+import struct
+import sys
+import threading
 import time
 import logging
+import clock
+from multiprocessing import shared_memory
 from readerwriterlock import rwlock
 from logdecorator import log_on_start, log_on_end, log_on_error
 
@@ -11,6 +20,19 @@ logging.basicConfig(format=logging_format, level=logging.INFO,
                     datefmt="%H:%M:%S")
 
 
+def resolveFastPath(fast_path=None):
+    """
+    Function that decides whether a service should bypass the logging decorators.
+    An explicit True/False is returned as-is; None resolves to True whenever
+    DEBUG logging is disabled for this module at the time of the call
+    """
+
+    if fast_path is None:
+        fast_path = not logging.getLogger(__name__).isEnabledFor(DEBUG)
+
+    return fast_path
+
+
 class Bus:
     """
     Class to allow a single element data bus.
@@ -20,9 +42,29 @@ class Bus:
         self.message = initial_message
         self.name = name
 
+        # Count of messages written so far, and the conditions of any services
+        # that want to be woken up when a new message arrives
+        self.seq = 0
+        self.timestamp = clock.time()  # when the current message was written
+        self.listeners = []
+
         # Set up the class so that functions can get a lock while working
         self.lock = rwlock.RWLockFairD()
 
+    def subscribe(self, condition):
+        """
+        Register a threading.Condition to be notified each time a message is written
+        """
+        self.listeners.append(condition)
+
+    def unsubscribe(self, condition):
+        self.listeners.remove(condition)
+
+    def _notifyListeners(self):
+        for condition in self.listeners:
+            with condition:
+                condition.notify_all()
+
     @log_on_start(DEBUG, "{self.name:s}: Initiating read by {_name:s}")
     @log_on_error(DEBUG, "{self.name:s}: Error on read by {_name:s}")
     @log_on_end(DEBUG, "{self.name:s}: Finished read by {_name:s}")
@@ -38,6 +80,109 @@ class Bus:
     def set_message(self, message, _name):
         with self.lock.gen_wlock():
             self.message = message
+            self.seq += 1
+            self.timestamp = clock.time()
+        self._notifyListeners()
+
+    # Undecorated versions of the read and write functions, used by services
+    # running in fast-path mode so that no log messages are formatted
+    def _get_message(self):
+        with self.lock.gen_rlock():
+            message = self.message
+
+        return message
+
+    def _set_message(self, message):
+        with self.lock.gen_wlock():
+            self.message = message
+            self.seq += 1
+            self.timestamp = clock.time()
+        self._notifyListeners()
+
+
+class SharedBus:
+    """
+    Class for a single element data bus whose message lives in shared memory,
+    so that services running in separate processes see each other's writes.
+    Messages (numbers, small structs, numpy arrays, ...) are pickled into a
+    fixed-size slot, next to a sequence number and a write timestamp.
+    runConcurrently creates these automatically for the process backend
+    """
+
+    # seq, timestamp, message length
+    HEADER = struct.Struct("=Qdi")
+
+    # Already visible to every process, so runConcurrently leaves it in place
+    process_shared = True
+
+    def __init__(self, initial_message=0, name="Unnamed Bus", slot_size=65536):
+        self.name = name
+        self.slot_size = slot_size
+        self.listeners = []
+
+        self.shm = shared_memory.SharedMemory(create=True, size=self.HEADER.size + slot_size)
+        self.lock = multiprocessing.get_context("fork").Lock()
+        self._write(initial_message, 0)
+
+    def _write(self, message, seq):
+        data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.slot_size:
+            raise ValueError("{0}: message of {1} bytes does not fit in a {2} byte slot".format(
+                self.name, len(data), self.slot_size))
+        with self.lock:
+            self.HEADER.pack_into(self.shm.buf, 0, seq, clock.time(), len(data))
+            self.shm.buf[self.HEADER.size:self.HEADER.size + len(data)] = data
+
+    def _readHeader(self):
+        return self.HEADER.unpack_from(self.shm.buf, 0)
+
+    @property
+    def seq(self):
+        return self._readHeader()[0]
+
+    @property
+    def timestamp(self):
+        return self._readHeader()[1]
+
+    @property
+    def message(self):
+        return self._get_message()
+
+    def subscribe(self, condition):
+        """
+        Register a threading.Condition to be notified on writes made from this
+        process. Writes from other processes do not notify it
+        """
+        self.listeners.append(condition)
+
+    def unsubscribe(self, condition):
+        self.listeners.remove(condition)
+
+    def get_message(self, _name):
+        return self._get_message()
+
+    def set_message(self, message, _name):
+        self._set_message(message)
+
+    def _get_message(self):
+        with self.lock:
+            length = self._readHeader()[2]
+            data = bytes(self.shm.buf[self.HEADER.size:self.HEADER.size + length])
+        return pickle.loads(data)
+
+    def _set_message(self, message):
+        # Only one writer per bus is expected, so the read-modify-write of seq is safe
+        self._write(message, self.seq + 1)
+        for condition in self.listeners:
+            with condition:
+                condition.notify_all()
+
+    def close(self):
+        """
+        Release the shared memory block. Only call once every process is done with the bus
+        """
+        self.shm.close()
+        self.shm.unlink()
 
 
 # Create a set of default input and output busses
@@ -76,7 +221,12 @@ class ConsumerProducer:
                  output_busses=default_output_bus,
                  delay=0,
                  termination_busses=default_termination_bus,
-                 name="Unnamed consumer_producer"):
+                 name="Unnamed consumer_producer",
+                 fast_path=None,  # skip the logging decorators in the loop (None: only if DEBUG is off)
+                 trigger=None,  # "any"/"all": run when any/all input busses have new messages, instead of sleeping
+                 max_latency=None,  # longest time in seconds to wait for a trigger (None waits indefinitely)
+                 period=None,  # run on a fixed period in seconds, measured from absolute deadlines, instead of sleeping
+                 skip_missed=False):  # in period mode, drop cycles whose deadline has already passed
 
         self.consumer_producer_function = consumer_producer_function
         self.input_busses = ensureTuple(input_busses)
@@ -85,29 +235,138 @@ class ConsumerProducer:
         self.termination_busses = ensureTuple(termination_busses)
         self.name = name
 
+        # Decide once, at construction, which versions of the bus functions the loop uses
+        self.fast_path = resolveFastPath(fast_path)
+
+        # In trigger mode, the input and termination busses wake this service up
+        # through a shared condition whenever they receive a message. The
+        # condition is only subscribed while the service runs, so busses do not
+        # collect listeners from every pipeline ever built on them
+        if trigger not in (None, "any", "all"):
+            raise ValueError("trigger should be None, 'any' or 'all', not {0}".format(trigger))
+        self.trigger = trigger
+        self.max_latency = max_latency
+        self.trigger_condition = threading.Condition()
+
+        # In period mode the loop keeps an absolute deadline, so the time spent
+        # in the work function does not stretch the period
+        self.period = period
+        self.skip_missed = skip_missed
+        self.next_deadline = None
+        self.overruns = 0  # cycles that started after their deadline had passed
+        self.skipped_cycles = 0  # cycles dropped because skip_missed is set
+
+        # Timing instrumentation is off unless enableMetrics is called
+        self.metrics = None
+
+    def enableMetrics(self, size=1000):
+        """
+        Turn on timing instrumentation for this service, keeping the last
+        "size" samples of each measurement, and return the StageMetrics object
+        """
+        self.metrics = StageMetrics(self.name, size)
+        return self.metrics
+
     @log_on_start(DEBUG, "{self.name:s}: Starting consumer-producer service")
     @log_on_error(DEBUG, "{self.name:s}: Encountered an error while executing consumer-producer")
     @log_on_end(DEBUG, "{self.name:s}: Closing down consumer-producer service")
     def __call__(self):
 
-        while True:
-
-            # Check if the loop should terminate
-            # termination_value = self.termination_busses[0].get_message(self.name)
-            if self.checkTerminationBusses():
-                break
-
-            # Collect all of the values from the input busses into a list
-            input_values = self.collectBussesToValues(self.input_busses)
-
-            # Get the output value or tuple of values corresponding to the inputs
-            output_values = self.consumer_producer_function(*input_values)
-
-            # Deal the values into the output busses
-            self.dealValuesToBusses(output_values, self.output_busses)
-
-            # Pause for set amount of time
-            time.sleep(self.delay)
+        # Pick the undecorated helpers up front so the loop does no per-iteration logging work
+        if self.fast_path:
+            checkTerminationBusses = self._checkTerminationBussesFast
+            collectBussesToValues = self._collectBussesToValuesFast
+            dealValuesToBusses = self._dealValuesToBussesFast
+        else:
+            checkTerminationBusses = self.checkTerminationBusses
+            collectBussesToValues = self.collectBussesToValues
+            dealValuesToBusses = self.dealValuesToBusses
+
+        self.next_deadline = clock.monotonic()
+        metrics = self.metrics
+
+        # Producers read only default_input_bus, which is never written, so
+        # the age of their input says nothing and is not recorded
+        timed_inputs = [p for p in ensureTuple(self.input_busses) if p is not default_input_bus]
+        read_age = None
+
+        triggers = self.input_busses + self.termination_busses if self.trigger else ()
+        for p in triggers:
+            p.subscribe(self.trigger_condition)
+        try:
+            while True:
+
+                # Check if the loop should terminate
+                # termination_value = self.termination_busses[0].get_message(self.name)
+                if checkTerminationBusses():
+                    break
+
+                # Note which messages are about to be consumed, so that trigger mode
+                # can tell when new ones have arrived
+                if self.trigger:
+                    seen_seqs = [p.seq for p in self.input_busses]
+
+                # Collect all of the values from the input busses into a list
+                if metrics:
+                    t_start = clock.perf_counter()
+                    if timed_inputs:
+                        read_age = clock.time() - min(p.timestamp for p in timed_inputs)
+                input_values = collectBussesToValues(self.input_busses)
+
+                # Get the output value or tuple of values corresponding to the inputs
+                output_values = self.consumer_producer_function(*input_values)
+                if metrics:
+                    metrics.record(t_start, clock.perf_counter() - t_start, read_age, self.overruns)
+
+                # Deal the values into the output busses
+                dealValuesToBusses(output_values, self.output_busses)
+
+                # Wait for new input in trigger mode, for the next deadline in period
+                # mode, and otherwise pause for set amount of time
+                if self.trigger:
+                    self.waitForInputs(seen_seqs)
+                elif self.period:
+                    self.waitForDeadline()
+                else:
+                    clock.sleep(self.delay)
+        finally:
+            for p in triggers:
+                p.unsubscribe(self.trigger_condition)
+
+    def waitForDeadline(self):
+        """
+        Advance the deadline by one period and sleep until it. If the deadline
+        has already passed, count an overrun and either start the next cycle
+        straight away or, with skip_missed, move on to the next future deadline
+        """
+
+        self.next_deadline += self.period
+        now = clock.monotonic()
+
+        if now > self.next_deadline:
+            self.overruns += 1
+            if not self.skip_missed:
+                return
+            missed = int((now - self.next_deadline) // self.period) + 1
+            self.skipped_cycles += missed
+            self.next_deadline += missed * self.period
+
+        clock.sleep(self.next_deadline - now)
+
+    def waitForInputs(self, seen_seqs):
+        """
+        Block until the input busses hold messages newer than seen_seqs (any or
+        all of them, depending on the trigger mode), a termination bus is set,
+        or max_latency seconds have passed
+        """
+
+        changed = any if self.trigger == "any" else all
+
+        def ready():
+            return (changed(p.seq != seq for p, seq in zip(self.input_busses, seen_seqs))
+                    or self._checkTerminationBussesFast())
+
+        clock.wait_for(ready, self.max_latency, self.trigger_condition)
 
     # Take in a bus or a tuple of busses, and store their
     # messages into a list
@@ -158,6 +417,15 @@ class ConsumerProducer:
         for idx, v in enumerate(values):
             busses[idx].set_message(v, self.name)
 
+    @staticmethod
+    def _prepareValuesForBusses(values, busses):
+        # Same dealing rules as dealValuesToBusses, without any logging
+        if len(busses) == 1:
+            return (values,)
+        if isinstance(values, tuple):
+            return values
+        return tuple([values] * len(busses))
+
     @log_on_start(DEBUG, "{self.name:s}: Starting to check termination busses")
     @log_on_error(DEBUG, "{self.name:s}: Encountered an error while checking termination busses")
     @log_on_end(DEBUG, "{self.name:s}: Finished checking termination busses")
@@ -169,6 +437,126 @@ class ConsumerProducer:
         # If any of the termination busses have triggered, signal the loop to end
         return any(termination_values)
 
+    # Fast-path versions of the bus helpers. These are only used by __call__
+    # when self.fast_path is set, and skip both the decorators on this class
+    # and the decorators on Bus.get_message/set_message
+    def _collectBussesToValuesFast(self, busses):
+        return [p._get_message() for p in busses]
+
+    def _dealValuesToBussesFast(self, values, busses):
+        for bus, v in zip(busses, self._prepareValuesForBusses(values, busses)):
+            bus._set_message(v)
+
+    def _checkTerminationBussesFast(self):
+        for p in self.termination_busses:
+            if p._get_message():
+                return True
+        return False
+
+
+class StageMetrics:
+    """
+    Class that keeps ring buffers of timing samples for one service: the loop
+    period, the execution time of the work function, and the age of the oldest
+    input message when it was read (for services with inputs), along with the
+    service's overrun count
+    """
+
+    def __init__(self, name="Unnamed stage", size=1000):
+        self.name = name
+        self.periods = collections.deque(maxlen=size)
+        self.work_times = collections.deque(maxlen=size)
+        self.read_ages = collections.deque(maxlen=size)
+        self.iterations = 0
+        self.overruns = 0
+        self.last_start = None
+
+        # Held briefly so that snapshots never see a buffer mid-update
+        self.lock = threading.Lock()
+
+    def record(self, start, work_time, read_age, overruns):
+        with self.lock:
+            if self.last_start is not None:
+                self.periods.append(start - self.last_start)
+            self.last_start = start
+            self.work_times.append(work_time)
+            if read_age is not None:
+                self.read_ages.append(read_age)
+            self.iterations += 1
+            self.overruns = overruns
+
+    def snapshot(self):
+        """
+        Return a copy of the raw samples and counters
+        """
+        with self.lock:
+            return {"name": self.name,
+                    "iterations": self.iterations,
+                    "overruns": self.overruns,
+                    "periods": list(self.periods),
+                    "work_times": list(self.work_times),
+                    "read_ages": list(self.read_ages)}
+
+    @staticmethod
+    def summarize(samples):
+        """
+        Summary statistics for a list of samples in seconds
+        """
+        if not samples:
+            return {"count": 0}
+        ordered = sorted(samples)
+        count = len(ordered)
+        mean = sum(ordered) / count
+        return {"count": count,
+                "mean": mean,
+                "min": ordered[0],
+                "p50": ordered[count // 2],
+                "p95": ordered[min(count - 1, int(count * 0.95))],
+                "max": ordered[-1],
+                "jitter": (sum((x - mean) ** 2 for x in ordered) / count) ** 0.5}
+
+    @staticmethod
+    def histogram(samples, bins=10):
+        """
+        Split the range of the samples into equal bins and return a list of
+        (low edge, high edge, count) tuples
+        """
+        if not samples:
+            return []
+        low, high = min(samples), max(samples)
+        width = (high - low) / bins or 1e-9
+        counts = [0] * bins
+        for x in samples:
+            counts[min(bins - 1, int((x - low) / width))] += 1
+        return [(low + i * width, low + (i + 1) * width, c) for i, c in enumerate(counts)]
+
+    def report(self, bins=10):
+        """
+        Return summary statistics for each measurement and a histogram of the loop period
+        """
+        snapshot = self.snapshot()
+        return {"name": snapshot["name"],
+                "iterations": snapshot["iterations"],
+                "overruns": snapshot["overruns"],
+                "period": self.summarize(snapshot["periods"]),
+                "period_histogram": self.histogram(snapshot["periods"], bins),
+                "work_time": self.summarize(snapshot["work_times"]),
+                "read_age": self.summarize(snapshot["read_ages"])}
+
+    def formatReport(self):
+        """
+        Render report() as a few human-readable lines, with times in milliseconds
+        """
+        report = self.report()
+        lines = ["{}: {} iterations, {} overruns".format(report["name"], report["iterations"], report["overruns"])]
+        for key in ("period", "work_time", "read_age"):
+            stats = report[key]
+            if stats["count"]:
+                lines.append("  {:>9s}: mean {:8.3f} ms | p50 {:8.3f} | p95 {:8.3f} | max {:8.3f} | jitter {:8.3f}".format(
+                    key, stats["mean"] * 1e3, stats["p50"] * 1e3, stats["p95"] * 1e3, stats["max"] * 1e3,
+                    stats["jitter"] * 1e3))
+        return "\n".join(lines)
+
 
 class Producer(ConsumerProducer):
     """
@@ -184,7 +572,10 @@ class Producer(ConsumerProducer):
                  output_busses,
                  delay=0,
                  termination_busses=default_termination_bus,
-                 name="Unnamed producer"):
+                 name="Unnamed producer",
+                 fast_path=None,
+                 period=None,
+                 skip_missed=False):
         # Producers don't use an input bus
         input_busses = default_input_bus
 
@@ -200,7 +591,10 @@ class Producer(ConsumerProducer):
             output_busses,
             delay,
             termination_busses,
-            name)
+            name,
+            fast_path,
+            period=period,
+            skip_missed=skip_missed)
 
 
 class Consumer(ConsumerProducer):
@@ -217,7 +611,12 @@ class Consumer(ConsumerProducer):
                  input_busses,
                  delay=0,
                  termination_busses=default_termination_bus,
-                 name="Unnamed consumer"):
+                 name="Unnamed consumer",
+                 fast_path=None,
+                 trigger=None,
+                 max_latency=None,
+                 period=None,
+                 skip_missed=False):
         # Match naming convention for this class with its parent class
         consumer_producer_function = consumer_function
 
@@ -231,7 +630,12 @@ class Consumer(ConsumerProducer):
             output_busses,
             delay,
             termination_busses,
-            name)
+            name,
+            fast_path,
+            trigger,
+            max_latency,
+            period,
+            skip_missed)
 
 
 class Timer(Producer):
@@ -249,26 +653,34 @@ class Timer(Producer):
                  duration=5,  # how many seconds the timer should run for (0 is forever)
                  delay=0,  # how many seconds to sleep for between checking time
                  termination_busses=default_termination_bus,
-                 name="Unnamed termination timer"):
+                 name="Unnamed termination timer",
+                 fast_path=None):
+
+        # The undecorated timer check is used in fast-path mode
+        timer_function = self._timer if resolveFastPath(fast_path) else self.timer
 
         super().__init__(
-            self.timer,  # Timer class defines its own producer function
+            timer_function,  # Timer class defines its own producer function
             timer_busses,
             delay,
             termination_busses,
-            name)
+            name,
+            fast_path)
 
         self.duration = duration
-        self.t_start = time.time()
+        self.t_start = clock.time()
 
     @log_on_start(DEBUG, "{self.name:s}: Checking current time against starting time")
     @log_on_error(DEBUG, "{self.name:s}: Encountered an error while checking current time against starting time")
     @log_on_end(DEBUG, "{self.name:s}: Finished checking current time against starting time")
     def timer(self):
+        return self._timer()
+
+    def _timer(self):
 
         # Trigger the timer if the duration is non-zero and the time elapsed
         # since instantiation is longer than the duration
-        if self.duration and (time.time() > (self.t_start + self.duration)):
+        if self.duration and (clock.time() > (self.t_start + self.duration)):
             print(self.name + ": DING!")
             return True  # Marker that the timer has triggered
         else:
@@ -288,14 +700,20 @@ class Printer(Consumer):
                  delay=0,  # how many seconds to sleep for between printing data
                  termination_busses=default_termination_bus,  # busses to check for termination
                  name="Unnamed termination timer",  # name of this printer
-                 print_prefix="Unspecified printer: "):  # prefix for output
+                 print_prefix="Unspecified printer: ",  # prefix for output
+                 fast_path=None,  # skip the logging decorators in the loop
+                 trigger=None,  # "any": print each new message instead of polling
+                 max_latency=None):  # longest time to wait for a new message in trigger mode
 
         super().__init__(
             self.print_bus,  # Printer class defines its own printing function
             printer_bus,
             delay,
             termination_busses,
-            name)
+            name,
+            fast_path,
+            trigger,
+            max_latency)
 
         self.print_prefix = print_prefix
 
@@ -303,24 +721,331 @@ class Printer(Consumer):
         print(self.print_prefix + str(message))
 
 
+class MetricsPrinter(Producer):
+    """
+    MetricsPrinter is a producer that periodically prints the timing report of
+    a set of services that have had enableMetrics called on them
+    """
+
+    @log_on_start(DEBUG, "{name:s}: Starting to create metrics printer")
+    @log_on_error(DEBUG, "{name:s}: Encountered an error while creating metrics printer")
+    @log_on_end(DEBUG, "{name:s}: Finished creating metrics printer")
+    def __init__(self,
+                 services,  # services whose metrics should be printed
+                 delay=1,  # how many seconds to sleep for between reports
+                 termination_busses=default_termination_bus,  # busses to check for termination
+                 name="Unnamed metrics printer"):  # name of this printer
+
+        super().__init__(
+            self.print_metrics,  # MetricsPrinter class defines its own printing function
+            default_output_bus,
+            delay,
+            termination_busses,
+            name)
+
+        self.services = tuple(services) if isinstance(services, list) else ensureTuple(services)
+
+    def print_metrics(self):
+        for service in self.services:
+            if service.metrics is not None:
+                print(service.metrics.formatReport())
+
+
+def setTerminationBusses(producer_consumer_list):
+    """
+    Function that sets every termination bus used by a set of services to True,
+    so that all of them leave their loops at the next check
+    """
+
+    seen = set()
+    for cp in producer_consumer_list:
+        for p in cp.termination_busses:
+            if id(p) not in seen:
+                seen.add(id(p))
+                p._set_message(True)
+
+
+def superviseThreads(callables, stop, join_timeout=1.0):
+    """
+    Function that runs each callable in its own thread and waits for all of
+    them to return. The moment one of them raises (or the waiting thread is
+    interrupted), stop() is called so the others can wind down, they are given
+    join_timeout seconds to exit, and the first error is re-raised. Threads
+    cannot be killed, so any that ignore stop() are left running and logged.
+    Every thread is registered with the clock while it runs, so that under a
+    clock.SimClock virtual time only moves on once all of them are asleep
+    """
+
+    def runRegistered(rank, c):
+        try:
+            clock.start(rank)
+            return c()
+        finally:
+            clock.unregister()
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(callables))
+    try:
+        clock.register(len(callables))
+        futures = [executor.submit(runRegistered, rank, c) for rank, c in enumerate(callables)]
+
+        try:
+            done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_EXCEPTION)
+        except BaseException:
+            # e.g. a KeyboardInterrupt in the supervising thread
+            stop()
+            concurrent.futures.wait(futures, timeout=join_timeout)
+            raise
+
+        # Judge failures from the futures wait() reports as done: done
+        # callbacks may not have run yet when wait() returns
+        failures = [f for f in futures if f in done and f.exception() is not None]
+        if failures:
+            stop()
+            _, pending = concurrent.futures.wait(futures, timeout=join_timeout)
+            if pending:
+                logging.warning("superviseThreads: {0} thread(s) still running {1} s after stop".format(
+                    len(pending), join_timeout))
+            raise failures[0].exception()
+    finally:
+        executor.shutdown(wait=False)
+
+
 @log_on_start(DEBUG, "runConcurrently: Starting concurrent execution")
 @log_on_error(DEBUG, "runConcurrently: Encountered an error during concurrent execution")
 @log_on_end(DEBUG, "runConcurrently: Finished concurrent execution")
-def runConcurrently(producer_consumer_list):
+def runConcurrently(producer_consumer_list, backend="thread", join_timeout=1.0):
     """
-    runConcurrently is aFunction that uses a concurrent.futures ThreadPoolExecutor to concurrently
-    execute a set of ConsumerProducer functions
+    runConcurrently is aFunction that concurrently executes a set of
+    ConsumerProducer functions. The "thread" backend uses a concurrent.futures
+    ThreadPoolExecutor; the "process" backend runs each service in its own
+    process so they do not compete for the GIL. As soon as any service raises,
+    every termination bus is set, the others get join_timeout seconds to stop,
+    and the first error is re-raised
     """
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=len(producer_consumer_list)) as executor:
+    if backend == "process":
+        return runInProcesses(producer_consumer_list, join_timeout=join_timeout)
+    if backend != "thread":
+        raise ValueError("backend should be 'thread' or 'process', not {0}".format(backend))
+
+    superviseThreads(producer_consumer_list,
+                     lambda: setTerminationBusses(producer_consumer_list),
+                     join_timeout)
+
+
+def _runStageInProcess(cp, errors):
+    # Body of each process in the process backend: report an error to the
+    # supervising process before exiting with a failure code
+    try:
+        cp()
+    except BaseException as error:
+        try:
+            pickle.dumps(error)
+        except Exception:
+            error = RuntimeError("{0}: {1!r}".format(cp.name, error))
+        errors.put(error)
+        raise
+
+
+def _callIfLoaded(module_names, function_name):
+    # Call function_name in each of the named modules that this process has
+    # imported, so the process backend can keep hardware modules in step
+    # without rossros depending on them
+    for module_name in module_names:
+        module = sys.modules.get(module_name)
+        if module is not None:
+            getattr(module, function_name)()
+
+
+def runInProcesses(producer_consumer_list, slot_size=65536, join_timeout=1.0):
+    """
+    Process backend for runConcurrently. Every bus used by the services is
+    swapped for a SharedBus holding its current message, each service is run in
+    a forked process, and once they have all exited the final messages are
+    copied back into the original busses. Busses cannot wake services in other
+    processes, so services in trigger mode need a max_latency to poll at.
+    Hardware objects created before the call may be used from several
+    services: the I2C bus lock is process-shared (see i2c.get_smbus), so
+    exchanges such as ADC reads are not interleaved between processes, and it
+    is replaced if a process has to be killed while it might hold it.
+    If a service fails, the termination busses are set, and any process still
+    running join_timeout seconds later is terminated
+    """
+
+    if clock.is_virtual():
+        raise ValueError("runInProcesses: a simulated clock cannot be shared between processes")
+
+    for cp in producer_consumer_list:
+        if cp.trigger and cp.max_latency is None:
+            raise ValueError("{0}: trigger mode needs a max_latency with the process backend".format(cp.name))
+
+    # Map each distinct bus to its shared-memory replacement
+    shared_busses = {}
+    original_busses = {}
+    for cp in producer_consumer_list:
+        original_busses[cp] = (cp.input_busses, cp.output_busses, cp.termination_busses)
+        for attr in ("input_busses", "output_busses", "termination_busses"):
+            busses = getattr(cp, attr)
+            for p in busses:
+                if id(p) not in shared_busses:
+                    if getattr(p, "process_shared", False):
+                        shared_busses[id(p)] = (p, p)
+                    else:
+                        shared_busses[id(p)] = (p, SharedBus(p.message, p.name, slot_size))
+            setattr(cp, attr, tuple(shared_busses[id(p)][1] for p in busses))
+
+    context = multiprocessing.get_context("fork")
+    errors = context.Queue()
+    processes = [context.Process(target=_runStageInProcess, args=(cp, errors), name=cp.name)
+                 for cp in producer_consumer_list]
+
+    def stopProcesses():
+        # Let the services drain through their termination busses, and kill
+        # only the ones that are still running after join_timeout
+        setTerminationBusses(producer_consumer_list)
+        deadline = time.monotonic() + join_timeout
+        for process in processes:
+            process.join(max(0, deadline - time.monotonic()))
+        terminated = False
+        for process in processes:
+            if process.is_alive():
+                logging.warning("runConcurrently: terminating {0}, still running {1} s after stop".format(
+                    process.name, join_timeout))
+                process.terminate()
+                process.join()
+                terminated = True
+        if terminated:
+            # A killed service may have been holding an I2C bus lock, which
+            # would then never be released
+            _callIfLoaded(("i2c", "i2c_sim"), "reset_locks")
+
+    try:
+        for process in processes:
+            process.start()
+
+        # Wait for the processes one exit at a time, stopping everything on the first failure
+        running = {process.sentinel: process for process in processes}
+        while running:
+            for sentinel in multiprocessing.connection.wait(list(running)):
+                process = running.pop(sentinel)
+                process.join()
+                if process.exitcode != 0:
+                    stopProcesses()
+                    running = {}
+                    break
+    except BaseException:
+        stopProcesses()
+        raise
+    finally:
+        # Put the original busses back, carrying over the last messages
+        for cp, (input_busses, output_busses, termination_busses) in original_busses.items():
+            cp.input_busses = input_busses
+            cp.output_busses = output_busses
+            cp.termination_busses = termination_busses
+        for original, shared in shared_busses.values():
+            if shared is original:
+                continue
+            if shared.seq:
+                original._set_message(shared.message)
+            shared.close()
+        # The stages may have driven the PWM channels, so this process no longer knows what the board holds
+        _callIfLoaded(("pwm", "pwm_sim"), "invalidate")
+
+    failed = [process.name for process in processes if process.exitcode != 0]
+    if failed:
+        try:
+            error = errors.get(timeout=join_timeout)
+        except Exception:
+            error = RuntimeError("runConcurrently: services exited with an error: {0}".format(", ".join(failed)))
+        raise error
+
+
+def benchmarkFastPath(duration=2.0):
+    """
+    Micro-benchmark that runs a three-stage sense/interpret/control pipeline
+    for "duration" seconds, first through the logging decorators and then in
+    fast-path mode, and reports the iterations/second of each stage
+    """
+
+    results = {}
+
+    for fast_path in (False, True):
+
+        counts = {"sense": 0, "interpret": 0, "control": 0}
+
+        def sense():
+            counts["sense"] += 1
+            return counts["sense"]
+
+        def interpret(sensor_value):
+            counts["interpret"] += 1
+            return sensor_value * 2
+
+        def control(direction):
+            counts["control"] += 1
+
+        sensor_bus = Bus(0, "Benchmark Sensor Bus")
+        interp_bus = Bus(0, "Benchmark Interp Bus")
+        term_bus = Bus(False, "Benchmark Term Bus")
+
+        runConcurrently([
+            Producer(sense, sensor_bus, 0, term_bus, "Benchmark sense", fast_path),
+            ConsumerProducer(interpret, sensor_bus, interp_bus, 0, term_bus, "Benchmark interpret", fast_path),
+            Consumer(control, interp_bus, 0, term_bus, "Benchmark control", fast_path),
+            Timer(term_bus, duration, 0.01, term_bus, "Benchmark timer", fast_path)])
+
+        mode = "fast path" if fast_path else "logging decorators"
+        results[mode] = {stage: count / duration for stage, count in counts.items()}
+        for stage, rate in results[mode].items():
+            print("{:>18s} | {:>9s}: {:10.0f} iterations/s".format(mode, stage, rate))
+
+    return results
+
+
+class _BenchmarkStageFailure(Exception):
+    pass
+
+
+def benchmarkStopLatency(trials=5, delay=0.05, backend="thread"):
+    """
+    Measure how long runConcurrently takes to return after one stage of a
+    three-stage pipeline raises, with every stage sleeping "delay" seconds per
+    loop. Reports and returns the worst case over "trials" runs
+    """
+
+    latencies = []
+
+    for trial in range(trials):
+
+        failed_at = multiprocessing.Value("d", 0.0)
+        counts = {"sense": 0}
+
+        def sense():
+            counts["sense"] += 1
+            if counts["sense"] == 5:
+                failed_at.value = time.time()
+                raise _BenchmarkStageFailure("sense stage failed")
+            return counts["sense"]
+
+        sensor_bus = Bus(0, "Benchmark Sensor Bus")
+        interp_bus = Bus(0, "Benchmark Interp Bus")
+        term_bus = Bus(False, "Benchmark Term Bus")
+
+        try:
+            runConcurrently([
+                Producer(sense, sensor_bus, delay, term_bus, "Benchmark sense"),
+                ConsumerProducer(lambda x: x * 2, sensor_bus, interp_bus, delay, term_bus, "Benchmark interpret"),
+                Consumer(lambda x: None, interp_bus, delay, term_bus, "Benchmark control")],
+                backend=backend)
+        except _BenchmarkStageFailure:
+            latencies.append(time.time() - failed_at.value)
 
-        # Create a list to hold the executors created from the provided functions
-        executor_list = []
+    worst = max(latencies)
+    print("{0} backend: worst-case stop latency {1:.1f} ms over {2} trials ({3} ms loop delay)".format(
+        backend, worst * 1e3, len(latencies), delay * 1e3))
+    return worst
 
-        # Loop over the list of provided functions, turning each into an executor for the thread pool
-        for cp in producer_consumer_list:
-            executor_list.append(executor.submit(cp))
 
-    # Loop over the executors that were created above, running their result methods
-    for e in executor_list:
-        e.result()
\ No newline at end of file
+if __name__ == "__main__":
+    benchmarkFastPath()
+    benchmarkStopLatency()
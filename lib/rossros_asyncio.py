@@ -0,0 +1,261 @@
+#! /usr/bin/python3
+"""
+asyncio version of the rossros services. All of the services run as tasks in
+a single event loop instead of one thread each, which suits the many
+lightweight, mostly-waiting stages of a pipeline (timers, printers,
+telemetry). Work functions may be plain functions (called directly, so they
+must be quick), coroutine functions (awaited), or blocking functions such as
+I2C reads, which are marked blocking=True and run in a bounded thread pool.
+Busses are the ordinary rossros busses, so the two engines share them
+"""
+import asyncio
+import concurrent.futures
+import time
+import logging
+from logdecorator import log_on_start, log_on_end, log_on_error
+import rossros as rr
+from rossros import Bus, default_termination_bus, default_input_bus, default_output_bus
+
+DEBUG = logging.DEBUG
+
+
+class ConsumerProducer(rr.ConsumerProducer):
+    """
+    Class that turns a provided function into an asyncio service that reads
+    from the input busses, stores the resulting data into the output busses,
+    and watches a set of termination busses for a "True" signal, at which
+    point the service shuts down
+    """
+
+    @log_on_start(DEBUG, "{name:s}: Starting to create async consumer-producer")
+    @log_on_error(DEBUG, "{name:s}: Encountered an error while creating async consumer-producer")
+    @log_on_end(DEBUG, "{name:s}: Finished creating async consumer-producer")
+    def __init__(self,
+                 consumer_producer_function,
+                 input_busses=default_input_bus,
+                 output_busses=default_output_bus,
+                 delay=0,
+                 termination_busses=default_termination_bus,
+                 name="Unnamed consumer_producer",
+                 blocking=False):  # run the function in the blocking-call executor instead of the event loop
+
+        super().__init__(
+            consumer_producer_function,
+            input_busses,
+            output_busses,
+            delay,
+            termination_busses,
+            name,
+            fast_path=True)
+
+        self.blocking = blocking
+        self.is_coroutine = asyncio.iscoroutinefunction(consumer_producer_function)
+
+    async def __call__(self, executor=None):
+
+        loop = asyncio.get_running_loop()
+
+        while True:
+
+            # Check if the loop should terminate
+            if self._checkTerminationBussesFast():
+                break
+
+            # Collect all of the values from the input busses into a list
+            input_values = self._collectBussesToValuesFast(self.input_busses)
+
+            # Get the output value or tuple of values corresponding to the inputs,
+            # without holding up the event loop
+            if self.is_coroutine:
+                output_values = await self.consumer_producer_function(*input_values)
+            elif self.blocking:
+                output_values = await loop.run_in_executor(
+                    executor, self.consumer_producer_function, *input_values)
+            else:
+                output_values = self.consumer_producer_function(*input_values)
+
+            # Deal the values into the output busses
+            self._dealValuesToBussesFast(output_values, self.output_busses)
+
+            # Hand control back to the other services for the set amount of time
+            await asyncio.sleep(self.delay)
+
+
+class Producer(ConsumerProducer):
+    """
+    Special case of the async consumer-producer class, that sends values to
+    busses but does not read them
+    """
+
+    def __init__(self,
+                 producer_function,
+                 output_busses,
+                 delay=0,
+                 termination_busses=default_termination_bus,
+                 name="Unnamed producer",
+                 blocking=False):
+
+        # Keep the producer a coroutine function if it was one, so it still gets awaited
+        if asyncio.iscoroutinefunction(producer_function):
+            async def consumer_producer_function(_input_value): return await producer_function()
+        else:
+            def consumer_producer_function(_input_value): return producer_function()
+
+        super().__init__(
+            consumer_producer_function,
+            default_input_bus,
+            output_busses,
+            delay,
+            termination_busses,
+            name,
+            blocking)
+
+
+class Consumer(ConsumerProducer):
+    """
+    Special case of the async consumer-producer class, that reads values from
+    busses but does not send to them
+    """
+
+    def __init__(self,
+                 consumer_function,
+                 input_busses,
+                 delay=0,
+                 termination_busses=default_termination_bus,
+                 name="Unnamed consumer",
+                 blocking=False):
+
+        super().__init__(
+            consumer_function,
+            input_busses,
+            default_output_bus,
+            delay,
+            termination_busses,
+            name,
+            blocking)
+
+
+class Timer(Producer):
+    """
+    Timer is an async producer that sets its output busses to True once the
+    time since it was instantiated is longer than its "duration" parameter
+    """
+
+    def __init__(self,
+                 timer_busses,  # busses that should be set to true when timer triggers
+                 duration=5,  # how many seconds the timer should run for (0 is forever)
+                 delay=0,  # how many seconds to wait for between checking time
+                 termination_busses=default_termination_bus,
+                 name="Unnamed termination timer"):
+
+        super().__init__(
+            self.timer,
+            timer_busses,
+            delay,
+            termination_busses,
+            name)
+
+        self.duration = duration
+        self.t_start = time.time()
+
+    def timer(self):
+
+        # Trigger the timer if the duration is non-zero and the time elapsed
+        # since instantiation is longer than the duration
+        if self.duration and (time.time() > (self.t_start + self.duration)):
+            print(self.name + ": DING!")
+            return True  # Marker that the timer has triggered
+        else:
+            return False  # Marker that the timer has not yet triggered
+
+
+class Printer(Consumer):
+    """
+    Printer is an async consumer that reads a value stored in a bus and prints
+    it out at specified intervals
+    """
+
+    def __init__(self,
+                 printer_bus,  # bus that should be printed to the terminal
+                 delay=0,  # how many seconds to wait for between printing data
+                 termination_busses=default_termination_bus,  # busses to check for termination
+                 name="Unnamed printer",  # name of this printer
+                 print_prefix="Unspecified printer: "):  # prefix for output
+
+        super().__init__(
+            self.print_bus,
+            printer_bus,
+            delay,
+            termination_busses,
+            name)
+
+        self.print_prefix = print_prefix
+
+    def print_bus(self, message):
+        print(self.print_prefix + str(message))
+
+
+async def runServices(producer_consumer_list, max_blocking_workers=4, join_timeout=1.0):
+    """
+    Coroutine that runs a set of async services as tasks in the current event
+    loop, with blocking work functions sharing a pool of max_blocking_workers
+    threads. If a service raises, every termination bus is set, the rest get
+    join_timeout seconds to finish before being cancelled, and the first error
+    is re-raised
+    """
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_blocking_workers) as executor:
+
+        tasks = [asyncio.ensure_future(cp(executor)) for cp in producer_consumer_list]
+
+        try:
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        except BaseException:
+            rr.setTerminationBusses(producer_consumer_list)
+            for task in tasks:
+                task.cancel()
+            raise
+
+        failures = [task for task in tasks if task in done and task.exception() is not None]
+        if failures:
+            rr.setTerminationBusses(producer_consumer_list)
+            if pending:
+                _, pending = await asyncio.wait(pending, timeout=join_timeout)
+            for task in pending:
+                task.cancel()
+            raise failures[0].exception()
+
+
+@log_on_start(DEBUG, "runConcurrently: Starting asyncio execution")
+@log_on_error(DEBUG, "runConcurrently: Encountered an error during asyncio execution")
+@log_on_end(DEBUG, "runConcurrently: Finished asyncio execution")
+def runConcurrently(producer_consumer_list, max_blocking_workers=4, join_timeout=1.0):
+    """
+    runConcurrently is a function that runs a set of async ConsumerProducer
+    services in one event loop until they have all finished
+    """
+
+    asyncio.run(runServices(producer_consumer_list, max_blocking_workers, join_timeout))
+
+
+def main():
+    # A handful of lightweight stages sharing one thread, plus one blocking stage
+    count_bus = Bus(0, "Count Bus")
+    slow_bus = Bus(0, "Slow Bus")
+    term_bus = Bus(False, "Term Bus")
+    counter = iter(range(1000000))
+
+    def slow_read():
+        time.sleep(0.05)  # Stand-in for an I2C read
+        return time.time()
+
+    services = [Producer(lambda: next(counter), count_bus, 0.01, term_bus, "Counter"),
+                Producer(slow_read, slow_bus, 0, term_bus, "Slow reader", blocking=True),
+                Timer(term_bus, 2, 0.01, term_bus, "Timer")]
+    services += [Printer(count_bus, 0.5, term_bus, "Printer {0}".format(i), "Printer {0}: ".format(i))
+                 for i in range(20)]
+    runConcurrently(services)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,14 +8,33 @@ class Servo(object):
     MAX_PW = 2500
     MIN_PW = 500
     _freq = 50
+    TABLE_STEP = 0.1  # degrees between angle_fast table entries
     def __init__(self, pwm):
         super().__init__()
         self.pwm = pwm
         self.pwm.period(4095)
         prescaler = int(float(self.pwm.CLOCK) /self.pwm._freq/self.pwm.period())
         self.pwm.prescaler(prescaler)
+        self.build_table()
         # self.angle(90)
 
+    def build_table(self):
+        """Precompute the pulse width angle() would send for every TABLE_STEP from -90 to 90 degrees. Call again if
+        MIN_PW, MAX_PW or the PWM period change."""
+        steps = int(round(180 / self.TABLE_STEP))
+        self._entries_per_degree = 1 / self.TABLE_STEP
+        period = self.pwm.period()
+        self._table = [int(self.map(-90 + i * self.TABLE_STEP, -90, 90, self.MIN_PW, self.MAX_PW) / 20000 * period)
+                       for i in range(steps + 1)]
+
+    def angle_fast(self, angle):
+        """Same as angle(), rounded to the nearest TABLE_STEP, using the precomputed table. For the control loop."""
+        if angle < -90:
+            angle = -90
+        elif angle > 90:
+            angle = 90
+        self.pwm.pulse_width(self._table[int((angle + 90) * self._entries_per_degree + 0.5)])
+
     def map(self, x, in_min, in_max, out_min, out_max):
         return (x - in_min) * (out_max - out_min) / (in_max - in_min) + out_min
         
@@ -35,6 +54,23 @@ class Servo(object):
         # self._debug("pulse width value: %d" % value)
         self.pwm.pulse_width(value)
 
+def benchmark(iterations=100000):
+    """Time angle() against angle_fast() sweeping a servo back and forth, as the steering does on every tick. The
+    pulse widths are computed but not sent, so this measures the conversion alone, not the I2C write."""
+    import time
+    from pwm import PWM
+    servo = Servo(PWM("P2"))
+    servo.pwm.pulse_width = lambda value: None
+    angles = [(i % 601) / 10 - 30 for i in range(iterations)]
+    results = {}
+    for method in (servo.angle, servo.angle_fast):
+        t_start = time.perf_counter()
+        for angle in angles:
+            method(angle)
+        results[method.__name__] = iterations / (time.perf_counter() - t_start)
+    print("angle: {angle:.0f} calls/s, angle_fast: {angle_fast:.0f} calls/s".format(**results))
+    return results
+
 def test():
     from ezblock import PWM
     print("Test")
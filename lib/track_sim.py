@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Kinematic track simulator for running the line following loop without the robot.
+
+A Track is a 2D raster of floor brightness with a dark line painted on it. The Simulator moves a bicycle model of the
+PiCar-X over the track using the steering angle and rear motor PWM that a (simulated) Picarx last commanded, and feeds
+the three grayscale channels through adc_sim.ADC, so Grayscale_Module, Interpreter and Controller run unchanged.
+Time only advances when step() is called, so runs go as fast as the code allows rather than in real time."""
+
+import math
+import numpy as np
+import adc_sim
+import logging
+
+
+class Track(object):
+    """Floor raster in ADC units, `resolution` meters per pixel, with the origin at the center of the raster."""
+
+    def __init__(self, raster, resolution=0.005, centerline_distance=None):
+        self.raster = np.asarray(raster, dtype=np.float64)
+        self.resolution = resolution
+        self.height, self.width = self.raster.shape
+        # Optional function (x, y) -> distance from the middle of the line in meters, for cross-track error.
+        self.centerline_distance = centerline_distance
+
+    @classmethod
+    def oval(cls, straight=1.0, radius=0.5, line_width=0.02, floor=1400, line=400, resolution=0.005, margin=0.3):
+        """Stadium shaped loop: two straights of length `straight` joined by half circles of radius `radius`."""
+        half = straight / 2
+
+        def centerline_distance(x, y):
+            # Distance to the straight segment between (-half, 0) and (half, 0), minus the radius.
+            dx = np.maximum(np.abs(x) - half, 0)
+            return np.abs(np.hypot(dx, y) - radius)
+
+        width = int(2 * (half + radius + margin) / resolution)
+        height = int(2 * (radius + margin) / resolution)
+        xs = (np.arange(width) - width / 2) * resolution
+        ys = (np.arange(height) - height / 2) * resolution
+        grid_x, grid_y = np.meshgrid(xs, ys)
+        raster = np.where(centerline_distance(grid_x, grid_y) <= line_width / 2, line, floor)
+        return cls(raster, resolution, centerline_distance)
+
+    def sample(self, x, y):
+        """Brightness under the point (x, y) in meters. Off the raster reads as the floor at the nearest edge."""
+        col = min(max(int(x / self.resolution + self.width / 2), 0), self.width - 1)
+        row = min(max(int(y / self.resolution + self.height / 2), 0), self.height - 1)
+        return self.raster[row, col]
+
+
+class CarModel(object):
+    """Bicycle model of the PiCar-X. Positive steering angles turn right, as in Picarx.forward."""
+
+    def __init__(self, x=0.0, y=0.0, heading=0.0, wheelbase=0.095, max_speed=0.5, max_steering=30,
+                 sensor_ahead=0.07, sensor_spacing=0.02):
+        self.x = x
+        self.y = y
+        self.heading = heading  # Radians, counterclockwise from the +x axis.
+        self.wheelbase = wheelbase
+        self.max_speed = max_speed  # m/s at 100% PWM.
+        self.max_steering = max_steering
+        self.sensor_ahead = sensor_ahead
+        self.sensor_spacing = sensor_spacing
+
+    def sensor_positions(self):
+        """(x, y) of the three grayscale sensors. Sensor 0 is on the left, as the Interpreter assumes."""
+        cos_h, sin_h = math.cos(self.heading), math.sin(self.heading)
+        front_x = self.x + self.sensor_ahead * cos_h
+        front_y = self.y + self.sensor_ahead * sin_h
+        return [(front_x - offset * sin_h, front_y + offset * cos_h)
+                for offset in (self.sensor_spacing, 0.0, -self.sensor_spacing)]
+
+    def step(self, dt, steering_angle, speed_percent):
+        steering = math.radians(max(-self.max_steering, min(self.max_steering, steering_angle)))
+        speed = speed_percent / 100 * self.max_speed
+        self.heading -= speed / self.wheelbase * math.tan(steering) * dt
+        self.x += speed * math.cos(self.heading) * dt
+        self.y += speed * math.sin(self.heading) * dt
+
+
+class Simulator(object):
+    """Couples a CarModel on a Track to a simulated Picarx and to adc_sim."""
+
+    def __init__(self, track=None, car=None, noise=0.0, seed=0, line_threshold=None):
+        self.track = Track.oval() if track is None else track
+        # Default start: on the bottom straight of the oval, driving in +x along the line.
+        self.car = CarModel(y=-0.5) if car is None else car
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+        self.line_threshold = (self.track.raster.max() + self.track.raster.min()) / 2 if line_threshold is None \
+            else line_threshold
+        self.picarx = None
+        self.time = 0.0
+        self.steps = 0
+        self.steps_off_line = 0
+        self.squared_error = 0.0
+
+    def attach(self, picarx):
+        """Drive the model from this Picarx's commands and serve its grayscale readings from the track."""
+        self.picarx = picarx
+        adc_sim.source = self.read_channel
+
+    def detach(self):
+        self.picarx = None
+        adc_sim.source = None
+
+    def read_channel(self, channel):
+        """ADC reading for channel A0-A2 from the track under the matching sensor. Other channels read 0."""
+        if channel > 2:
+            return 0
+        x, y = self.car.sensor_positions()[channel]
+        value = self.track.sample(x, y)
+        if self.noise:
+            value += self.rng.normal(0, self.noise)
+        return int(value)
+
+    def commanded_speed(self):
+        """Average rear wheel PWM percent, signed for forward motion. Picarx drives the right motor mirrored, so
+        forward is left direction pin low and right direction pin high (with the default [1, 1] calibration)."""
+        left_pwm, right_pwm = self.picarx.motor_speed_pins
+        left_dir, right_dir = self.picarx.motor_direction_pins
+        left = getattr(left_pwm, '_pulse_width_percent', 0) * (1 if not left_dir._value else -1)
+        right = getattr(right_pwm, '_pulse_width_percent', 0) * (1 if right_dir._value else -1)
+        return (left + right) / 2
+
+    def step(self, dt=0.01):
+        """Advance the model by dt seconds of virtual time using the latest Picarx commands, and update the stats."""
+        self.car.step(dt, self.picarx.dir_current_angle, self.commanded_speed())
+        self.time += dt
+        self.steps += 1
+        readings = [self.track.sample(x, y) for x, y in self.car.sensor_positions()]
+        if min(readings) > self.line_threshold:
+            self.steps_off_line += 1
+        if self.track.centerline_distance is not None:
+            self.squared_error += float(self.track.centerline_distance(self.car.x, self.car.y)) ** 2
+
+    def stats(self):
+        """Fraction of steps with no sensor over the line, and RMS distance of the car from the centerline (m)."""
+        steps = max(self.steps, 1)
+        return {"time": self.time,
+                "steps": self.steps,
+                "off_line": self.steps_off_line / steps,
+                "rms_error": math.sqrt(self.squared_error / steps)}
+
+
+def run_line_follower(steps=5000, dt=0.01, proportional_gain=10, derivative_gain=1, pwm_percent=30, simulator=None):
+    """Run Grayscale_Module -> Interpreter -> Controller.follow_line on a simulated car for `steps` control steps of
+    `dt` seconds of virtual time, and return the simulator stats."""
+    import picarx_improved
+    import grayscale_module
+    import line_following_interpreter as interp
+    import line_following_controller as control
+    logging.getLogger().setLevel(logging.WARNING)  # The modules above turn on DEBUG logging of every car command.
+
+    simulator = Simulator() if simulator is None else simulator
+    car = picarx_improved.Picarx()
+    simulator.attach(car)
+    try:
+        sensor = grayscale_module.Grayscale_Module(950)
+        interpreter = interp.Interpreter(proportional_gain=proportional_gain, derivative_gain=derivative_gain,
+                                         line_polarity='darker')
+        controller = control.Controller(car, pwm_percent=pwm_percent)
+        controller.fill_buffer(interpreter, sensor)
+        for i in range(steps):
+            direction = interpreter.get_direction(sensor.get_grayscale_data())
+            controller.follow_line(direction)
+            simulator.step(dt)
+    finally:
+        simulator.detach()
+    return simulator.stats()
+
+
+def run_concurrent_line_follower(duration=600, dt=0.01, sensor_delay=0.01, interp_delay=0.01, control_delay=0.02,
+                                 proportional_gain=10, derivative_gain=1, pwm_percent=30, simulator=None):
+    """Run concurrent_picar's sense, interpret and control loops, with the sonar ranging in the background, for
+    `duration` seconds of virtual time on a clock.SimClock, and return the simulator stats. A physics loop and a timer
+    run next to them, each in its own thread under rossros.superviseThreads as in concurrent_picar.main. Every thread
+    sleeps on the simulated clock, so the run takes as long as the computation does, and the loops interleave the same
+    way on every run."""
+    import clock
+    import bus
+    import rossros as rr
+    import picarx_improved
+    import grayscale_module
+    import ultrasonic
+    import line_following_interpreter as interp
+    import line_following_controller as control
+    import concurrent_picar
+    logging.getLogger().setLevel(logging.WARNING)
+
+    simulator = Simulator() if simulator is None else simulator
+    previous_clock = clock.set_clock(clock.SimClock())
+    car = picarx_improved.Picarx()
+    simulator.attach(car)
+    sonar = ultrasonic.get_sensor()
+    try:
+        sensor = grayscale_module.Grayscale_Module(950)
+        interpreter = interp.Interpreter(proportional_gain=proportional_gain, derivative_gain=derivative_gain,
+                                         line_polarity='darker')
+        controller = control.Controller(car, pwm_percent=pwm_percent)
+        controller.fill_buffer(interpreter, sensor)
+        sensor_bus = bus.SeqBus()
+        interp_bus = bus.SeqBus()
+        concurrent_picar.init_busses(sensor_bus, interp_bus, sensor, interpreter)
+        term_bus = bus.SeqBus(False)
+
+        def physics():
+            while not term_bus.read():
+                simulator.step(dt)
+                clock.sleep(dt)
+
+        def timer():
+            # Started from a registered thread, so the ranger joins virtual time in step with the loops.
+            sonar.start_ranging()
+            clock.sleep(duration)
+            concurrent_picar.stop_all(term_bus, car)
+
+        rr.superviseThreads([physics,
+                             lambda: concurrent_picar.concurrent_sense(sensor, sensor_bus, sensor_delay, term_bus),
+                             lambda: concurrent_picar.concurrent_interp(interpreter, sensor_bus, interp_bus,
+                                                                        interp_delay, term_bus),
+                             lambda: concurrent_picar.concurrent_control(controller, sonar, interp_bus,
+                                                                         control_delay, term_bus),
+                             timer],
+                            lambda: concurrent_picar.stop_all(term_bus, car))
+    finally:
+        sonar.stop_ranging()
+        simulator.detach()
+        clock.set_clock(previous_clock)
+    return simulator.stats()
+
+
+def test(duration=20, seed=1):
+    """Regression test for line_following_controller and the concurrent_picar loops: with a fixed seed, both must
+    keep the car on the oval. A controller that steers the wrong way or too weakly leaves the line for over 75% of the
+    steps and ends up several centimeters off it."""
+    steps = int(duration / 0.01)
+    for name, stats in [("Sequential", run_line_follower(steps=steps, simulator=Simulator(noise=20, seed=seed))),
+                        ("Concurrent", run_concurrent_line_follower(duration=duration,
+                                                                    simulator=Simulator(noise=20, seed=seed)))]:
+        assert stats["steps"] == steps, (name, stats)
+        assert stats["off_line"] <= 0.5, (name, stats)
+        assert stats["rms_error"] <= 0.015, (name, stats)
+        print("{}: {}".format(name, stats))
+    print("Line follower tests passed.")
+
+
+def main():
+    import time
+    steps = 5000
+    t_start = time.perf_counter()
+    stats = run_line_follower(steps=steps)
+    elapsed = time.perf_counter() - t_start
+    print(stats)
+    print("{} control steps in {:.2f} s ({:.0f} steps/s, {:.0f}x real time)".format(
+        steps, elapsed, steps / elapsed, stats["time"] / elapsed))
+
+    t_start = time.perf_counter()
+    stats = run_concurrent_line_follower(duration=600)
+    elapsed = time.perf_counter() - t_start
+    print(stats)
+    print("Concurrent pipeline: {:.0f} s of virtual time in {:.2f} s ({:.0f}x real time)".format(
+        stats["time"], elapsed, stats["time"] / elapsed))
+
+if __name__ == "__main__":
+    main()
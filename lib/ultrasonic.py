@@ -1,35 +1,143 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import time
+import itertools
+import threading
+import numpy as np
+import clock
+from ring_bus import RingBus
+from bus import SeqBus
 from utils import reset_mcu
-reset_mcu()
-from pin import Pin
+import platform
+if platform.node() == 'raspberrypi' or platform.node() == 'cecilia':  # Import real classes on the picar.
+    from pin import Pin
+else:  # Not being run on the raspberry pi. Import simulation classes.
+    from pin_sim import Pin
+
+
+class PingSlot(object):
+    """Lets one sonar ping at a time in the whole process, so no sensor picks up another one's echoes.
+
+    Pings take turns in the order they ask for the slot, and each one keeps it until `settle` seconds after it was
+    sent, by which time its late echoes have died out. Waiting goes through clock.wait_for, so it also works on a
+    clock.SimClock. Both Ranger pings and blocking Ultrasonic reads go through the process-wide ping_slot."""
+
+    def __init__(self):
+        self._tickets = itertools.count()
+        self._serving = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        ticket = next(self._tickets)
+        clock.wait_for(lambda: self._serving == ticket, condition=self._condition)
+
+    def release(self):
+        with self._condition:
+            self._serving += 1
+            self._condition.notify_all()
+
+    def ping(self, send, settle):
+        """Call send() in this process' turn and hold the slot until settle seconds after it started. Returns what
+        send() returned."""
+        self.acquire()
+        try:
+            start = clock.time()
+            result = send()
+            clock.sleep(settle - (clock.time() - start))
+            return result
+        finally:
+            self.release()
+
+
+ping_slot = PingSlot()
+# Seconds a blocking read keeps the ping slot after sending its ping. See Ranger for the same limit on its period.
+PING_SETTLE = 0.06
+
+
+class DistanceFilter(object):
+    """Smoothed distance from a stream of sonar readings.
+
+    Timeouts (-1) and readings beyond max_distance are dropped. The rest go into a window of the last `window`
+    readings; the median of the window rejects single outliers (echoes off the floor, cross-talk), and an EWMA with
+    weight `alpha` on the newest median smooths out the jitter. If no valid reading arrives for max_age seconds the
+    path is taken to be clear, value() goes back to -1 and the window starts over with the next reading."""
+
+    def __init__(self, window=5, alpha=0.5, max_age=0.5, max_distance=300):
+        self.readings = RingBus(window, name="Ultrasonic Readings")
+        self.alpha = alpha
+        self.max_age = max_age
+        self.max_distance = max_distance
+        self._state = (-1, 0.0)  # (filtered distance, clock.time() of the last valid reading)
+
+    def update(self, cm):
+        if cm < 0 or cm > self.max_distance:
+            return
+        filtered, stamp = self._state
+        fresh = filtered >= 0 and clock.time() - stamp <= self.max_age
+        if not fresh:
+            self.readings.clear()  # Stale readings would outvote the new one in the median.
+        self.readings.write(cm)
+        median = float(np.median(self.readings.window()))
+        if fresh:
+            median = self.alpha * median + (1 - self.alpha) * filtered
+        self._state = (median, clock.time())
+
+    def value(self):
+        filtered, stamp = self._state
+        if filtered < 0 or clock.time() - stamp > self.max_age:
+            return -1
+        return filtered
 
 
 class Ultrasonic():
-    def __init__(self, timeout=0.02):
-        self.trig = Pin("D2")
-        self.echo = Pin("D3")
+    """One HC-SR04 style sonar on a trigger and an echo pin, created once and reused for every measurement.
+
+    Measurements are either blocking (read()), or made in the background by a Ranger, which publishes each distance on
+    self.distances and feeds self.filter so that distance() and obstacle() only read memory."""
+
+    def __init__(self, timeout=0.02, trig="D2", echo="D3"):
+        self.trig = Pin(trig)
+        self.echo = Pin(echo)
         self.timeout = timeout
+        # Background ranging state, see Ranger.
+        self.distances = SeqBus(-1, name="Ultrasonic Distance {}/{}".format(trig, echo))
+        self.ranger = None
+        self._pulse_start = None
+        self._armed = False
+        self.filter = DistanceFilter()
+
+    @property
+    def ranging(self):
+        return self.ranger is not None and self.ranger.running
 
     def _read(self):
+        """One blocking measurement in cm, -1 on timeout, taken in turn with every other ping in the process."""
+        return ping_slot.ping(self._ping_and_time, PING_SETTLE)
+
+    def _ping_and_time(self):
         self.trig.low()
-        time.sleep(0.01)
+        clock.sleep(0.01)
         self.trig.high()
-        time.sleep(0.00001)
+        clock.sleep(0.00001)
         self.trig.low()
         pulse_end = 0
         pulse_start = 0
-        timeout_start = time.time()
+        timeout_start = clock.time()
+        # A simulated clock only advances when the echo loops sleep on it. On the wall clock they must not sleep:
+        # giving up the GIL lets other threads delay the edge timestamps by milliseconds.
+        virtual = clock.is_virtual()
         while self.echo.value()==0:
-            pulse_start = time.time()
+            pulse_start = clock.time()
             if pulse_start - timeout_start > self.timeout:
                 return -1
+            if virtual:
+                clock.sleep(0)
         while self.echo.value()==1:
-            pulse_end = time.time()
+            pulse_end = clock.time()
             if pulse_end - timeout_start > self.timeout:
                 return -1
+            if virtual:
+                clock.sleep(0)
         during = pulse_end - pulse_start
         cm = round(during * 340 / 2 * 100, 2)
         return cm
@@ -41,17 +149,206 @@ class Ultrasonic():
                 return a
         return -1
 
-    def obstacle(self):
-        dist = self.read()
-        print("Distancd: {}".format(dist))
-        if dist > 0 and dist <=10:
-            return True
-        else:
-            return False
+    def measure(self):
+        """One raw distance in cm, -1 on timeout: the latest background result while ranging, else a blocking ping."""
+        if self.ranging:
+            return self.distances.read()
+        return self._read()
+
+    def start_ranging(self, period=0.06):
+        """Range this sensor in the background with the process-wide Ranger, so it takes turns with every other
+        sensor being ranged. `period` only applies if the shared ranger is not running yet. See Ranger."""
+        if self.ranging:
+            return
+        ranger = shared_ranger(period)
+        ranger.add(self)
+        ranger.start()
+
+    def stop_ranging(self):
+        if self.ranger is not None:
+            self.ranger.remove(self)
+
+    def _attach(self, ranger):
+        self.ranger = ranger
+        self.trig.low()
+        self.echo.irq(self._on_edge, Pin.IRQ_RISING_FALLING, bouncetime=None)
+
+    def _detach(self):
+        self.echo.irq_remove()
+        self._armed = False
+        self.ranger = None
+
+    def _ping(self):
+        """Publish a timeout if the previous ping never finished, then send the next one and arm the echo handler."""
+        if self._armed:
+            self._armed = False
+            self._publish(-1)
+        self._pulse_start = None
+        self._armed = True
+        self.trig.high()
+        clock.sleep(0.00001)
+        self.trig.low()
+
+    def _on_edge(self, _channel):
+        """Echo pin interrupt handler. The first edge after a ping is the start of the echo pulse, the second its end."""
+        now = clock.monotonic()
+        if not self._armed:
+            return
+        if self._pulse_start is None:
+            self._pulse_start = now
+            return
+        self._armed = False
+        during = now - self._pulse_start
+        self._publish(round(during * 340 / 2 * 100, 2) if during <= self.timeout else -1)
+
+    def _publish(self, cm):
+        self.distances.write(cm)
+        self.filter.update(cm)
+
+    def latest(self):
+        """(distance in cm, clock.time() it was measured) from the background ranger. -1 means no echo."""
+        distance, _, stamp = self.distances.read_stamped()
+        return distance, stamp
+
+    def distance(self):
+        """Filtered distance in cm, or -1 if nothing is in range. With background ranging running this only reads
+        the filter state; otherwise it first takes a blocking reading."""
+        if not self.ranging:
+            self._publish(self.read())
+        return self.filter.value()
+
+    def obstacle(self, threshold=10):
+        dist = self.distance()
+        return 0 < dist <= threshold
+
+
+class Ranger(object):
+    """Background ranging for any number of Ultrasonic sensors from a single thread.
+
+    The sensors are pinged one at a time, `period` seconds apart, and each echo is timed from edge interrupts on its
+    echo pin instead of by busy-waiting. Each ping holds ping_slot for its period, so only one ping is ever in flight,
+    blocking reads of sensors that are not being ranged included, and sensors cannot pick up each other's echoes; each
+    ranged sensor is therefore measured every len(sensors) * period seconds at most. Keep the period above about 60 ms
+    so a ping's late echoes are not taken for the next one's."""
+
+    def __init__(self, sensors=(), period=0.06):
+        self.sensors = list(sensors)
+        self.period = period
+        self.running = False
+        self.thread = None
+
+    def add(self, sensor):
+        if sensor in self.sensors:
+            return
+        self.sensors.append(sensor)
+        if self.running:
+            sensor._attach(self)
+
+    def remove(self, sensor):
+        """Stop ranging sensor. The thread stops with the last sensor and start() brings it back."""
+        if sensor not in self.sensors:
+            return
+        if len(self.sensors) == 1:
+            self.stop()
+        self.sensors.remove(sensor)
+        if sensor.ranger is self:
+            sensor._detach()
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        for sensor in self.sensors:
+            sensor._attach(self)
+        clock.register()  # So the ranger takes part in virtual time under a clock.SimClock.
+        self.thread = threading.Thread(target=self._run, name="Ultrasonic ranger", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        for sensor in self.sensors:
+            if sensor.ranger is self:
+                sensor._detach()
+
+    def _run(self):
+        try:
+            while self.running:
+                if not self.sensors:
+                    clock.sleep(self.period)
+                for sensor in list(self.sensors):
+                    if not self.running:
+                        break
+                    ping_slot.ping(sensor._ping, self.period)
+        finally:
+            clock.unregister()
+
+
+# One Ultrasonic per (trig, echo) pin pair and one Ranger for the whole process, so that every user of a sonar shares
+# its pins and its pings are scheduled together with all the others.
+_sensors = {}
+_ranger = None
+_registry_lock = threading.Lock()
+
+def get_sensor(trig="D2", echo="D3", timeout=0.02):
+    """The process-wide Ultrasonic on these pins, created on first use. Later calls get the same object, whatever
+    their timeout."""
+    with _registry_lock:
+        if (trig, echo) not in _sensors:
+            _sensors[(trig, echo)] = Ultrasonic(timeout, trig, echo)
+        return _sensors[(trig, echo)]
+
+def shared_ranger(period=0.06):
+    """The process-wide Ranger, created with this period on first use."""
+    global _ranger
+    with _registry_lock:
+        if _ranger is None:
+            _ranger = Ranger(period=period)
+        return _ranger
+
+
+def test():
+    """Check DistanceFilter, and that blocking reads take turns with a running Ranger, on a simulated clock."""
+    previous_clock = clock.set_clock(clock.SimClock())
+    try:
+        distance_filter = DistanceFilter()
+        for cm in [20, 21, 500, -1, 60, 19]:
+            distance_filter.update(cm)
+            clock.sleep(0.06)
+        assert 19 <= distance_filter.value() <= 21, "timeouts and outliers should be rejected"
+
+        # An obstacle that is gone must not come back from the old window with the first new echo.
+        distance_filter = DistanceFilter()
+        for i in range(5):
+            distance_filter.update(8)
+            clock.sleep(0.06)
+        clock.sleep(5)
+        assert distance_filter.value() == -1
+        distance_filter.update(150)
+        assert distance_filter.value() == 150, distance_filter.value()
+
+        # A blocking read waits for the ranger's ping to settle, and the ranger waits for it in turn.
+        ranged, blocking = Ultrasonic(trig="D2", echo="D3"), Ultrasonic(trig="D8", echo="D9")
+        ranger = Ranger([ranged], period=PING_SETTLE)
+        clock.register()
+        ranger.start()
+        start = clock.time()
+        for i in range(5):
+            blocking.measure()
+        elapsed = clock.time() - start
+        clock.unregister()  # Before joining the ranger thread, which would otherwise stop the clock.
+        ranger.stop()
+        assert 5 * PING_SETTLE <= elapsed <= 5 * 2 * PING_SETTLE + 0.01, elapsed
+    finally:
+        clock.set_clock(previous_clock)
+    print("Ultrasonic tests passed.")
 
 
 def main():
-    sonar = Ultrasonic()
+    reset_mcu()
+    sonar = get_sensor()
     while True:
         print(sonar.read())
 
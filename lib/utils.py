@@ -6,7 +6,13 @@ import time
 import os
 import re
 import math
-from pin import Pin
+import platform
+if platform.node() == 'raspberrypi' or platform.node() == 'cecilia':  # Import real classes on the picar.
+    from pin import Pin
+    import pwm
+else:  # Not being run on the raspberry pi. Import simulation classes.
+    from pin_sim import Pin
+    import pwm_sim as pwm
 
 mcu_reset = mcu_reset = Pin("MCURST")
 
@@ -15,6 +21,7 @@ def reset_mcu():
     time.sleep(0.001)
     mcu_reset.on() 
     time.sleep(0.1)  
+    pwm.invalidate()  # The reset cleared the PWM registers, so the write cache no longer matches the board.
 # ble = BLE()
 
 # ble.write('NAME+ezb-RPi')